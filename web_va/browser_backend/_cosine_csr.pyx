@@ -0,0 +1,30 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+"""
+CSR row · dense query kernel used by tabs_retriever to score every tab.
+
+Optional: build it in place with
+
+    cythonize -i _cosine_csr.pyx
+
+and tabs_retriever picks it up on import. Without the compiled module it
+falls back to the numba kernel, then to scipy's sparse product.
+"""
+
+ctypedef fused index_t:
+    int
+    long long
+
+
+def csr_dot_dense(const double[::1] data, const index_t[::1] indices,
+                  const index_t[::1] indptr, const double[::1] query,
+                  double[::1] out):
+    """out[row] = CSR row · dense query, with the GIL released."""
+    cdef Py_ssize_t row, j
+    cdef Py_ssize_t n_rows = indptr.shape[0] - 1
+    cdef double total
+    with nogil:
+        for row in range(n_rows):
+            total = 0.0
+            for j in range(indptr[row], indptr[row + 1]):
+                total = total + data[j] * query[indices[j]]
+            out[row] = total
@@ -1,54 +1,730 @@
 from openai import OpenAI
+import httpx
 import os
 from dotenv import load_dotenv
 import json
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from openai.types.chat import ChatCompletion
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+try:
+    from dateparser.search import search_dates
+except ImportError:
+    search_dates = None
+
+try:
+    import h2  # noqa: F401  (enables httpx HTTP/2 support)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
 
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-from calendar_tool import get_today_schedule, add_event, get_next_free_slots
+# One process-wide client whose connection pool stays warm, so completions
+# reuse open TLS connections instead of handshaking on every cold call.
+# HTTP/2 multiplexes concurrent requests over one socket when h2 is installed.
+http_client = httpx.Client(
+    http2=HTTP2_AVAILABLE,
+    limits=httpx.Limits(max_connections=20, max_keepalive_connections=20, keepalive_expiry=120),
+    timeout=httpx.Timeout(60.0, connect=10.0),
+)
+client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client)
+
+from calendar_tool import get_today_schedule, get_day_schedule, add_event, get_next_free_slots
 from tabs_retriever import group_tabs_for_subtasks, retriever_has_tabs
+from llm_cache import CompletionCache
+from semantic_cache import SemanticCache
+from llm_batch import BatchQueue
 
+# Low-temperature parsers answer the same input the same way, so their
+# output can be reused for a day. Creative replies only briefly.
+DETERMINISTIC_TTL_SECONDS = 24 * 60 * 60
+CREATIVE_TTL_SECONDS = 10 * 60
 
-def parse_event_from_message(user_message: str) -> dict:
+_completion_cache = CompletionCache(Path(__file__).resolve().parent / "llm_cache.sqlite3")
+
+# Near-duplicate chat messages ("i cant focus today" / "I can't focus
+# today!") reuse the previous reply. Only the plain chat branch uses it:
+# tabs, schedule and calendar replies depend on live state or have side
+# effects, so they always run.
+_chat_semantic_cache = SemanticCache(ttl_seconds=CREATIVE_TTL_SECONDS)
+
+# Offline requests (precomputed study plans, morning schedule summaries) go
+# through the Batch API at half price instead of live completions.
+_batch_queue = BatchQueue(client, Path(__file__).resolve().parent / "batch")
+
+# Shared pool for overlapping blocking network calls (OpenAI, Google Calendar)
+# within a single request.
+_io_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="adhdwiz-io")
+
+
+def cached_chat_completion(ttl_seconds: float = None, **kwargs) -> ChatCompletion:
     """
-    Use GPT to extract event details from natural language.
-    Returns dict with summary, start_time, end_time, description
+    Drop-in replacement for client.chat.completions.create that returns the
+    stored completion when an identical request was answered recently.
     """
-    prompt = f"""
-    Extract calendar event details from this message: "{user_message}"
-    
-    Return ONLY a JSON object with these fields:
-    {{
+    key = CompletionCache.make_key(kwargs)
+    cached = _completion_cache.get(key)
+    if cached is not None:
+        return ChatCompletion.model_validate(cached)
+
+    completion = client.chat.completions.create(**kwargs)
+
+    if ttl_seconds is None:
+        temperature = kwargs.get("temperature", 1.0)
+        ttl_seconds = DETERMINISTIC_TTL_SECONDS if temperature <= 0.3 else CREATIVE_TTL_SECONDS
+    _completion_cache.put(key, completion.model_dump(), ttl_seconds)
+    return completion
+
+
+def cached_chat_completion_stream(ttl_seconds: float = None, **kwargs):
+    """
+    Streaming counterpart of cached_chat_completion: yields text chunks as
+    the model produces them. A cached answer is yielded as a single chunk;
+    a fresh one is stored once the stream has been read to the end.
+    """
+    key = CompletionCache.make_key(kwargs)
+    cached = _completion_cache.get(key)
+    if cached is not None:
+        yield ChatCompletion.model_validate(cached).choices[0].message.content or ""
+        return
+
+    parts = []
+    last_chunk = None
+    finish_reason = "stop"
+    for chunk in client.chat.completions.create(stream=True, **kwargs):
+        last_chunk = chunk
+        if not chunk.choices:
+            continue
+        choice = chunk.choices[0]
+        if choice.finish_reason:
+            finish_reason = choice.finish_reason
+        text = choice.delta.content
+        if text:
+            parts.append(text)
+            yield text
+
+    if last_chunk is None:
+        return
+
+    if ttl_seconds is None:
+        temperature = kwargs.get("temperature", 1.0)
+        ttl_seconds = DETERMINISTIC_TTL_SECONDS if temperature <= 0.3 else CREATIVE_TTL_SECONDS
+    _completion_cache.put(key, {
+        "id": last_chunk.id,
+        "object": "chat.completion",
+        "created": last_chunk.created,
+        "model": last_chunk.model,
+        "choices": [{
+            "index": 0,
+            "finish_reason": finish_reason,
+            "message": {"role": "assistant", "content": "".join(parts).strip()},
+        }],
+    }, ttl_seconds)
+
+
+def enqueue_for_batch(messages: list, model: str = "gpt-4o-mini", custom_id: str = None, **params) -> str:
+    """
+    Queue a chat completion for the OpenAI Batch API instead of calling it
+    now. Returns the custom_id to look the reply up by with get_batch_reply
+    once the batch is done. The queue is submitted every few minutes.
+    """
+    custom_id = custom_id or uuid.uuid4().hex
+    return _batch_queue.enqueue(custom_id, model=model, messages=messages, **params)
+
+
+def get_batch_reply(custom_id: str):
+    """Reply text for a queued request, or None while its batch is still running."""
+    return _batch_queue.reply(custom_id)
+
+
+# Shared, byte-identical prefix for every system prompt. OpenAI only reuses
+# cached prompt prefixes once they pass 1024 tokens, so the persona and house
+# rules live here and every task-specific rubric is appended after it. The
+# block alone is about 1,150 tokens; re-count it with tiktoken after editing
+# so it stays above 1024. Keep anything that varies per call (user text,
+# timestamps) out of this block.
+ADHDWIZ_PREAMBLE = """
+You are ADHDWiz, a warm, practical assistant built for students and working
+adults with ADHD. You live inside a browser extension with a voice interface:
+people talk to you while juggling open tabs, deadlines, and a calendar that
+often feels like it is working against them. Every answer you produce is either
+read aloud by a text-to-speech voice, shown in a small popup, or consumed by
+code that turns your output into calendar events and tab groups.
+
+WHO YOU ARE TALKING TO
+- People who are smart and capable but struggle with task initiation, time
+  blindness, working memory, and emotional overwhelm.
+- They frequently arrive mid-spiral: behind on an assignment, unsure where to
+  start, or frozen by a long to-do list.
+- They respond best to warmth, brevity, and concrete next actions. Long
+  explanations, lectures, and vague advice make things worse.
+- Many of them have been told they are lazy. They are not. Never imply it.
+
+CORE PRINCIPLES
+1. Lower the activation energy. The best next step is small enough that it
+   feels almost silly not to do it: open the document, write one sentence,
+   find one source, set a timer for five minutes.
+2. Externalize time. People with ADHD often cannot feel time passing, so make
+   durations and start times explicit and realistic rather than optimistic.
+3. Reduce decisions. Offer one clear suggestion instead of a menu of options
+   whenever possible. Decision fatigue is real and it stalls momentum.
+4. Validate first, then act. A short acknowledgement of how the person feels
+   comes before any plan, but it stays short so the plan is not buried.
+5. Celebrate starting, not finishing. Showing up for step one is the win.
+6. No shame, no guilt, no "you should have". Past procrastination is not a
+   topic worth revisiting; the only question is what happens next.
+
+HOW TO READ REQUESTS
+- Treat casual or messy phrasing as normal. Voice transcripts often have
+  missing punctuation, filler words, and misheard terms; infer the most
+  likely intent instead of asking for clarification over small details.
+- Course names, assignment titles, and people's names should be preserved
+  exactly as the user wrote them, with obvious transcription noise removed.
+- When a request mentions a deadline or a time, assume the user's local time
+  zone and the current date supplied with the request.
+- When information is missing, choose a sensible default rather than stalling:
+  one hour for meetings, this afternoon for vague times, today for no date.
+
+TIME AND PLANNING HEURISTICS
+- Micro-steps are 5 to 20 minutes. Anything longer must be split further.
+- The very first step should take under five minutes and require no decisions.
+- Study sessions work best in focused blocks of 25 to 50 minutes with short
+  breaks between them; schedule breaks explicitly rather than assuming them.
+- Pad estimates: ADHD brains routinely underestimate how long things take, so
+  round durations up, not down.
+- Avoid stacking more than three new commitments in a single day unless the
+  user asks for it.
+
+SAFETY
+- If a message suggests the user is in crisis or thinking about self-harm,
+  respond with care, encourage reaching out to a trusted person, and point to
+  local emergency services or a crisis line. Do not continue with productivity
+  advice in that case.
+- Do not give medical advice about medication or diagnosis. It is fine to
+  suggest talking to a doctor or therapist.
+
+WHAT THIS ASSISTANT CAN AND CANNOT DO
+- It can add events to the user's Google Calendar, read today's schedule,
+  and look up the next free time slots before suggesting when to work.
+- It can group the user's open browser tabs by subtask so the tabs that
+  belong to the current step are easy to find and the rest can be ignored.
+- It can turn an uploaded syllabus into a week-by-week study plan.
+- It cannot send email or messages, submit assignments, browse the web, set
+  phone alarms, or see anything on screen beyond the tabs it was given. Do
+  not offer or claim to do any of those things; suggest a manual step instead.
+
+SPEAKING STYLE FOR VOICE
+- Replies are often read aloud, so write the way a calm friend would talk:
+  short sentences, everyday words, and one idea per sentence.
+- Say times the way people say them ("three thirty this afternoon"), and
+  avoid abbreviations, URLs, file paths, and symbols that sound odd when a
+  text-to-speech voice reads them out.
+- Put the single most useful action in the first or second sentence, since
+  many listeners stop paying attention after that.
+- Use the user's own words for their tasks and courses so they recognize
+  them immediately, instead of paraphrasing into something more formal.
+- Keep encouragement specific to what the user just did or said. Generic
+  praise sounds hollow when it is spoken, and it is easy to tune out.
+
+OUTPUT DISCIPLINE
+- Follow the task instructions that come after this section exactly. They
+  override the general tone guidance above when the two conflict.
+- When a task asks for JSON, respond with a single valid JSON object and
+  nothing else: no prose, no code fences, no comments.
+- When a task asks for plain text, do not wrap it in quotes or add labels.
+- Never invent calendar events, tabs, or syllabus content that the user did
+  not mention or that was not supplied to you.
+"""
+
+
+# -------------------------------------------------
+# PROMPTS
+# -------------------------------------------------
+# Built once at import; only the user turn is formatted per call.
+_PARSE_EVENT_SYSTEM = ADHDWIZ_PREAMBLE + """
+TASK: CALENDAR EVENT PARSER
+
+You are acting as a calendar event parser. Return only valid JSON.
+
+Extract calendar event details from the user's message.
+
+Return ONLY a JSON object with these fields:
+{
+    "summary": "event title",
+    "start_time": "2025-12-01T14:00:00",
+    "end_time": "2025-12-01T15:00:00",
+    "description": "optional description"
+}
+
+Rules:
+- Use ISO format for times (YYYY-MM-DDTHH:MM:SS)
+- If no date specified, assume today
+- If no end time specified, assume 1 hour duration
+- If time is vague (e.g., "afternoon"), use 2 PM
+- Resolve relative dates against the current date/time given with the message
+"""
+
+_BREAKDOWN_SYSTEM = ADHDWIZ_PREAMBLE + """
+TASK: MICRO-STEP BREAKDOWN
+
+You are acting as an ADHD task-breaking expert. Be specific and compassionate.
+
+The user seems overwhelmed or confused about starting a task. Break it into exactly 3 tiny, actionable subtasks.
+
+Return ONLY a JSON object:
+{
+    "task_name": "Main task name",
+    "subtasks": [
+        {"name": "Subtask 1", "duration_minutes": 5},
+        {"name": "Subtask 2", "duration_minutes": 10},
+        {"name": "Subtask 3", "duration_minutes": 15}
+    ]
+}
+
+Rules:
+- Each subtask should take 5-20 minutes max
+- Make them ADHD-friendly: specific, tiny, achievable
+- Start with the absolute easiest micro-step
+- Use action verbs ("Open laptop", "Find one source", "Write first sentence")
+- Duration should reflect realistic time needed
+"""
+
+_CLASSIFY_SYSTEM = ADHDWIZ_PREAMBLE + """
+TASK: INTENT ROUTER
+
+You route requests for ADHDWiz. Decide what the user wants and extract the
+details needed to act on it in a single pass.
+
+Return ONLY a JSON object:
+{
+    "intent": "tabs" | "overwhelm" | "add_event" | "schedule" | "chat",
+    "event": {
         "summary": "event title",
         "start_time": "2025-12-01T14:00:00",
         "end_time": "2025-12-01T15:00:00",
         "description": "optional description"
-    }}
-    
-    Rules:
-    - Use ISO format for times (YYYY-MM-DDTHH:MM:SS)
-    - If no date specified, assume today
-    - If no end time specified, assume 1 hour duration
-    - If time is vague (e.g., "afternoon"), use 2 PM
-    - Current date/time: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+    } or null,
+    "task_name": "Main task name" or null,
+    "subtasks": [
+        {"name": "Subtask 1", "duration_minutes": 5},
+        {"name": "Subtask 2", "duration_minutes": 10},
+        {"name": "Subtask 3", "duration_minutes": 15}
+    ] or null,
+    "core_task": "short study topic" or null
+}
+
+Intents:
+- "tabs": the user wants help finding or organizing browser tabs for a task.
+  Fill core_task with only the subject/topic, 3-8 words
+  ("find tabs for linear algebra midterm" -> "linear algebra midterm").
+- "overwhelm": the user is stuck, overwhelmed or unsure how to start a task.
+  Fill task_name and exactly 3 subtasks: tiny, specific, 5-20 minutes each,
+  starting with the absolute easiest micro-step and using action verbs
+  ("Open laptop", "Find one source", "Write first sentence").
+- "add_event": the user wants something put on their calendar.
+  Fill event using ISO times (YYYY-MM-DDTHH:MM:SS). If no date is given assume
+  today, if no end time assume 1 hour, if the time is vague ("afternoon") use
+  2 PM. Resolve relative dates against the current date/time given with the
+  message.
+- "schedule": the user asks what is on their calendar or what comes next.
+- "chat": anything else.
+
+Set every field that does not belong to the chosen intent to null.
+"""
+
+_SCHEDULE_SYSTEM = ADHDWIZ_PREAMBLE + """
+TASK: SCHEDULE SUMMARY
+
+You are ADHDWiz, a supportive ADHD coach.
+
+Summarize the user's schedule in a warm, ADHD-friendly tone.
+Use short paragraphs and reassuring words.
+"""
+
+_CHAT_SYSTEM = ADHDWIZ_PREAMBLE + """
+TASK: SUPPORT CHAT
+
+You are ADHDWiz — a warm, non-judgmental ADHD support assistant.
+
+Write in plain text only.
+Do not use any emojis.
+Do not use asterisks, bold, italics, markdown, or bullets.
+Do not use lists or special characters.
+Avoid symbols like *, -, •, >, _, or fancy formatting.
+
+Style:
+- short paragraphs
+- supportive, casual tone
+- micro-steps (30–60 seconds)
+- no shame, lots of validation
+
+When users express confusion or overwhelm about tasks, your responses should
+acknowledge their feelings and offer encouragement.
+"""
+
+_STUDY_PLAN_SYSTEM = ADHDWIZ_PREAMBLE + """
+TASK: STUDY ROADMAP
+
+You design concise, ADHD-friendly study roadmaps.
+
+Create a motivational week-by-week study roadmap from the syllabus notes the user sends.
+Each week should include:
+- Theme or chapter focus
+- 2-3 micro-actions (prefer verbs)
+- Estimated total hours
+- Tiny accountability or reward idea
+
+If info is missing, infer reasonable topics and keep it 6-8 weeks long.
+"""
+
+_EVENT_USER_TEMPLATE = """Message: "{user_message}"
+Current date/time: {now}"""
+
+_BREAKDOWN_USER_TEMPLATE = 'The user said: "{user_message}"'
+
+_SCHEDULE_USER_TEMPLATE = """The user's schedule is:
+
+{schedule_text}"""
+
+_STUDY_PLAN_USER_TEMPLATE = '''Syllabus notes:
+"""{syllabus}"""
+'''
+
+_EMPTY_SYLLABUS_NOTE = "No syllabus text was provided. Build a balanced 6-week plan for a college course."
+
+_CHAT_FUNCTIONS = [
+    {
+        "name": "get_relevant_tab_groups",
+        "description": "Find the browser tabs that best support a task and group them by micro-subtasks.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "task_description": {
+                    "type": "string",
+                    "description": "What the user is trying to accomplish. Example: 'Finish my biology lab writeup'."
+                }
+            },
+            "required": ["task_description"]
+        }
+    }
+]
+
+
+# -------------------------------------------------
+# KEYWORD TRIGGERS
+# -------------------------------------------------
+_TAB_TRIGGERS = frozenset({
+    "organize tabs",
+    "organise tabs",
+    "help with tabs",
+    "relevant tabs",
+    "which tabs",
+    "what tabs",
+    "tabs for",
+    "show tabs",
+    "find tabs for",
+    "help me focus on",
+})
+
+_OVERWHELM_TRIGGERS = frozenset({
+    "don't know where to start",
+    "dont know where to start",
+    "don't know how to start",
+    "dont know how to start",
+    "overwhelmed",
+    "too much",
+    "can't start",
+    "cant start",
+    "stuck",
+    "procrastinating",
+    "need to do",
+    "have to do",
+    "should do",
+    "supposed to",
+    "paralyzed",
+    "paralysed",
+    "freezing",
+    "can't focus on",
+    "cant focus on",
+})
+
+_ADD_EVENT_TRIGGERS = frozenset({
+    "add event",
+    "create event",
+    "schedule",
+    "remind me",
+    "block time",
+    "put on calendar",
+    "add to calendar",
+    "meeting at",
+    "appointment",
+})
+
+_SCHEDULE_TRIGGERS = frozenset({
+    "what do i have",
+    "what's next",
+    "what is next",
+    "my day",
+    "today",
+    "calendar",
+    "busy",
+    "what am i supposed to do",
+})
+
+# Listed in priority order: when a message hits triggers from several
+# intents, the first intent listed wins.
+_INTENT_TRIGGERS = (
+    ("tabs", _TAB_TRIGGERS),
+    ("overwhelm", _OVERWHELM_TRIGGERS),
+    ("add_event", _ADD_EVENT_TRIGGERS),
+    ("schedule", _SCHEDULE_TRIGGERS),
+)
+
+_TRIGGER_INTENT = {}
+_INTENT_RANK = {}
+for _rank, (_intent, _triggers) in enumerate(_INTENT_TRIGGERS):
+    _INTENT_RANK[_intent] = _rank
+    for _trigger in _triggers:
+        _TRIGGER_INTENT.setdefault(_trigger, _intent)
+
+# One case-insensitive alternation over every trigger. The lookahead makes
+# finditer report overlapping hits ("what am i supposed to do" also contains
+# "supposed to"), and alternatives are ordered by intent priority so the
+# higher-priority trigger wins when two start at the same position. ASCII
+# case folding only: Unicode folding lets "ſtuck" match "stuck", and its
+# .lower() is then not a trigger key.
+_TRIGGER_RE = re.compile(
+    "(?=("
+    + "|".join(
+        re.escape(trigger)
+        for trigger in sorted(
+            _TRIGGER_INTENT,
+            key=lambda t: (_INTENT_RANK[_TRIGGER_INTENT[t]], -len(t)),
+        )
+    )
+    + "))",
+    re.IGNORECASE | re.ASCII,
+)
+
+
+def _keyword_intent(user_message: str):
     """
-    
-    response = client.chat.completions.create(
+    Return the highest-priority intent whose trigger appears in the message,
+    or None when nothing matches.
+    """
+    best_rank = None
+    for match in _TRIGGER_RE.finditer(user_message):
+        rank = _INTENT_RANK[_TRIGGER_INTENT[match.group(1).lower()]]
+        if best_rank is None or rank < best_rank:
+            best_rank = rank
+            if rank == 0:
+                break
+    if best_rank is None:
+        return None
+    return _INTENT_TRIGGERS[best_rank][0]
+
+
+def _loads_json_content(content: str) -> dict:
+    """
+    Parse a JSON-mode completion. JSON mode normally returns a bare object,
+    and json.loads already skips surrounding whitespace, so this is a single
+    call; only if that fails are code fences or stray prose trimmed from the
+    edges before retrying.
+    """
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError:
+        start = content.find("{")
+        end = content.rfind("}")
+        if start == -1 or end < start:
+            raise
+        return json.loads(content[start:end + 1])
+
+
+# -------------------------------------------------
+# RULE-BASED EVENT PARSING
+# -------------------------------------------------
+_DATEPARSER_SETTINGS = {"PREFER_DATES_FROM": "future", "RETURN_AS_TIMEZONE_AWARE": False}
+
+# The rule-based path only accepts one clock time with am/pm (or noon) plus
+# at most one of today/tonight/tomorrow or a weekday. The start time is
+# computed here from those parts; dateparser only finds where the date text
+# is, since it misreads inputs like "10am on Monday".
+_CLOCK_TIME_RE = re.compile(
+    r"\b(?P<hour>\d{1,2})(?::(?P<minute>\d{2}))?\s*(?P<meridiem>am|pm|a\.m\.|p\.m\.)(?!\w)"
+    r"|\b(?P<noon>noon)\b",
+    re.IGNORECASE,
+)
+# Any time-like text the rule can't read ("7:30", "midnight") means GPT.
+_ANY_CLOCK_TIME_RE = re.compile(
+    r"\b\d{1,2}(?::\d{2})?\s*(?:am|pm|a\.m\.|p\.m\.)|\b\d{1,2}:\d{2}\b|\bnoon\b|\bmidnight\b",
+    re.IGNORECASE,
+)
+_WEEKDAYS = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+_DAY_WORD_RE = re.compile(
+    r"(?:\bon\s+)?\b(today|tonight|tomorrow|" + "|".join(_WEEKDAYS) + r")\b",
+    re.IGNORECASE,
+)
+# Months, durations, recurrence and relative dates all need GPT.
+_RULE_REJECT_RE = re.compile(
+    r"\b(?:jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?"
+    r"|sept?(?:ember)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)\b"
+    r"|\b(?:min(?:ute)?s?|hours?|hrs?|days?|weeks?|weekends?|months?|years?|half|quarter)\b"
+    r"|\b(?:every|each|daily|weekly|biweekly|monthly|yearly|nightly|weekdays|weeknights"
+    r"|recurring|repeat(?:ing)?|(?:mon|tues|wednes|thurs|fri|satur|sun)days)\b"
+    r"|\b(?:next|this|last|morning|afternoon|evening|night|until|till|from|between|through)\b",
+    re.IGNORECASE,
+)
+_QUESTION_RE = re.compile(
+    r"^\s*(?:what|when|which|who|how|do|does|did|is|am|are|can|could|should|will)\b|\?\s*$",
+    re.IGNORECASE,
+)
+_EVENT_COMMAND_RE = re.compile(
+    r"^\s*(?:please\s+)?(?:(?:can|could|would)\s+you\s+)?"
+    r"(?:add|create|schedule|put|book|set\s+up|block(?:\s+(?:off|out))?(?:\s+time)?|remind\s+me(?:\s+to)?)\b"
+    r"(?:\s+(?:an?|the|my)\b)?(?:\s+event\b)?(?:\s+(?:for|called|named|titled)\b)?",
+    re.IGNORECASE,
+)
+_CALENDAR_PHRASE_RE = re.compile(r"\b(?:to|on|in)\s+(?:my\s+|the\s+)?calendar\b", re.IGNORECASE)
+_EVENT_TAIL_RE = re.compile(r"\s*\b(?:at|on|for|by|from)\s*$", re.IGNORECASE)
+# Summaries that say nothing on their own ("schedule it for 3pm") or that
+# stop mid-phrase after a name was cut out.
+_VAGUE_SUMMARY_WORDS = frozenset({
+    "it", "this", "that", "them", "these", "those", "something", "stuff", "thing", "one",
+})
+_DANGLING_SUMMARY_WORDS = frozenset({
+    "with", "and", "or", "about", "to", "for", "of", "at", "on", "by", "the", "a", "an", "my",
+})
+
+
+def _rule_based_start(clock, day: str, now: datetime):
+    """Start datetime for one parsed clock time and optional day word, or None if unsure."""
+    if clock.group("noon"):
+        hour, minute = 12, 0
+    else:
+        hour = int(clock.group("hour"))
+        minute = int(clock.group("minute") or 0)
+        if not 1 <= hour <= 12 or minute > 59:
+            return None
+        hour = hour % 12 + (12 if clock.group("meridiem").lower().startswith("p") else 0)
+
+    start = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if day == "tomorrow":
+        return start + timedelta(days=1)
+    if day in _WEEKDAYS:
+        days_ahead = (_WEEKDAYS.index(day) - now.weekday()) % 7
+        # "Friday" said on a Friday could mean today or next week.
+        return start + timedelta(days=days_ahead) if days_ahead else None
+    if day == "tonight" and hour < 12:
+        return None
+    # Today (or no day at all): a time that already passed is ambiguous.
+    return start if start > now else None
+
+
+def _try_rule_based_parse(user_message: str, now: datetime = None):
+    """
+    Parse simple event requests ("add meeting with Sam at 3pm Friday")
+    locally. Returns the same dict shape as parse_event_from_message, or
+    None when the message has anything beyond one clock time and one day
+    word, and should go to GPT instead.
+    """
+    if search_dates is None or _QUESTION_RE.search(user_message) or _RULE_REJECT_RE.search(user_message):
+        return None
+
+    # "on my calendar" would otherwise lose its "on" to the date text.
+    text = _CALENDAR_PHRASE_RE.sub(" ", user_message)
+    clocks = list(_CLOCK_TIME_RE.finditer(text))
+    day_words = _DAY_WORD_RE.findall(text)
+    if len(clocks) != 1 or len(_ANY_CLOCK_TIME_RE.findall(text)) != 1 or len(day_words) > 1:
+        return None
+
+    now = now or datetime.now()
+    found = search_dates(
+        text,
+        languages=["en"],
+        settings={**_DATEPARSER_SETTINGS, "RELATIVE_BASE": now},
+    )
+    # Exactly one date expression, and it must be just the time and day.
+    if not found or len(found) != 1:
+        return None
+    date_text = found[0][0]
+    leftover = _DAY_WORD_RE.sub(" ", _CLOCK_TIME_RE.sub(" ", date_text)).lower().split()
+    if not _CLOCK_TIME_RE.search(date_text) or any(word not in ("at", "on") for word in leftover):
+        return None
+
+    start = _rule_based_start(clocks[0], day_words[0].lower() if day_words else None, now)
+    if start is None:
+        return None
+
+    summary = _DAY_WORD_RE.sub(" ", text.replace(date_text, " "))
+    summary = _EVENT_COMMAND_RE.sub("", summary)
+    summary = " ".join(summary.split())
+    while True:
+        trimmed = _EVENT_TAIL_RE.sub("", summary).strip(" ,.!;:-")
+        if trimmed == summary:
+            break
+        summary = trimmed
+
+    words = summary.lower().split()
+    if (
+        not words
+        or any(ch.isdigit() for ch in summary)
+        # A period left inside ("Dr. Smith") means the date search may
+        # have split the text at an abbreviation.
+        or "." in summary
+        or all(word in _VAGUE_SUMMARY_WORDS for word in words)
+        or words[-1] in _DANGLING_SUMMARY_WORDS
+    ):
+        return None
+
+    end = start + timedelta(hours=1)
+    return {
+        "summary": summary[0].upper() + summary[1:],
+        "start_time": start.strftime("%Y-%m-%dT%H:%M:%S"),
+        "end_time": end.strftime("%Y-%m-%dT%H:%M:%S"),
+        "description": "",
+    }
+
+
+def parse_event_from_message(user_message: str, now: datetime = None) -> dict:
+    """
+    Use GPT to extract event details from natural language.
+    Returns dict with summary, start_time, end_time, description.
+    Pass now to reuse the caller's timestamp for the whole turn.
+    """
+    now = now or datetime.now()
+    rule_based = _try_rule_based_parse(user_message, now)
+    if rule_based is not None:
+        return rule_based
+
+    prompt = _EVENT_USER_TEMPLATE.format(
+        user_message=user_message,
+        now=now.strftime("%Y-%m-%d %H:%M"),
+    )
+
+    response = cached_chat_completion(
         model="gpt-4o-mini",
         messages=[
-            {"role": "system", "content": "You are a calendar event parser. Return only valid JSON."},
+            {"role": "system", "content": _PARSE_EVENT_SYSTEM},
             {"role": "user", "content": prompt}
         ],
-        temperature=0.3
+        temperature=0.3,
+        response_format={"type": "json_object"}
     )
     
-    result = response.choices[0].message.content.strip()
-    result = re.sub(r'```json\n?|\n?```', '', result)
+    result = response.choices[0].message.content
     
-    return json.loads(result)
+    return _loads_json_content(result)
 
 
 def break_task_into_subtasks(user_message: str, context: str = "") -> dict:
@@ -56,47 +732,53 @@ def break_task_into_subtasks(user_message: str, context: str = "") -> dict:
     Use GPT to detect task overwhelm and break into 3 micro-subtasks.
     Returns dict with task_name and list of 3 subtasks with durations.
     """
-    prompt = f"""
-    The user said: "{user_message}"
-    
-    {f"Context: {context}" if context else ""}
-    
-    They seem overwhelmed or confused about starting a task. Break it into exactly 3 tiny, actionable subtasks.
+    prompt = _BREAKDOWN_USER_TEMPLATE.format(user_message=user_message)
+    if context:
+        prompt += f"\nContext: {context}"
+
+    response = cached_chat_completion(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": _BREAKDOWN_SYSTEM},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.7,
+        response_format={"type": "json_object"}
+    )
     
-    Return ONLY a JSON object:
-    {{
-        "task_name": "Main task name",
-        "subtasks": [
-            {{"name": "Subtask 1", "duration_minutes": 5}},
-            {{"name": "Subtask 2", "duration_minutes": 10}},
-            {{"name": "Subtask 3", "duration_minutes": 15}}
-        ]
-    }}
+    result = response.choices[0].message.content
     
-    Rules:
-    - Each subtask should take 5-20 minutes max
-    - Make them ADHD-friendly: specific, tiny, achievable
-    - Start with the absolute easiest micro-step
-    - Use action verbs ("Open laptop", "Find one source", "Write first sentence")
-    - Duration should reflect realistic time needed
+    return _loads_json_content(result)
+
+
+def classify_and_extract(user_message: str, now: datetime = None) -> dict:
     """
-    
-    response = client.chat.completions.create(
+    Use one GPT call to decide what the user wants and pull out everything
+    the matching ADHDWiz_respond branch needs, instead of a separate
+    parse/breakdown/extract round trip per branch.
+    Returns dict with intent, event, task_name, subtasks and core_task.
+    """
+    prompt = _EVENT_USER_TEMPLATE.format(
+        user_message=user_message,
+        now=(now or datetime.now()).strftime("%Y-%m-%d %H:%M"),
+    )
+
+    response = cached_chat_completion(
         model="gpt-4o-mini",
         messages=[
-            {"role": "system", "content": "You are an ADHD task-breaking expert. Be specific and compassionate."},
+            {"role": "system", "content": _CLASSIFY_SYSTEM},
             {"role": "user", "content": prompt}
         ],
-        temperature=0.7
+        temperature=0.3,
+        response_format={"type": "json_object"}
     )
-    
-    result = response.choices[0].message.content.strip()
-    result = re.sub(r'```json\n?|\n?```', '', result)
-    
-    return json.loads(result)
 
+    result = response.choices[0].message.content
+
+    return _loads_json_content(result)
 
-def ADHDWiz_respond(user_message: str) -> str:
+
+def ADHDWiz_respond(user_message: str, stream: bool = False):
     """
     Main AI agent:
     - Detects task overwhelm and auto-creates subtask calendar blocks
@@ -104,28 +786,56 @@ def ADHDWiz_respond(user_message: str) -> str:
     - Detects if user wants schedule summary
     - Detects if user wants tab organization
     - Otherwise responds in ADHDWiz voice
+
+    Returns the reply as a string, or with stream=True as an iterator of
+    text chunks so callers can start showing or speaking it right away.
+    Replies built from tool results arrive as a single chunk.
     """
-    user_lower = user_message.lower()
+    reply = _respond(user_message, stream)
+    if stream and isinstance(reply, str):
+        return iter((reply,))
+    return reply
+
+
+def _respond(user_message: str, stream: bool):
+    keyword_intent = _keyword_intent(user_message)
+
+    # One clock read per turn, shared by every parser that needs "now".
+    now = datetime.now()
+
+    # Tabs, overwhelm and event requests all need something extracted from the
+    # message, so one combined call both confirms the intent and extracts it.
+    # Schedule queries need no extraction and plain chat needs no routing.
+    analysis = {}
+    intent = keyword_intent or "chat"
+
+    # Looking up free calendar slots does not depend on the breakdown, so start
+    # it now and let it run while the model is still thinking.
+    free_slots_future = None
+    if keyword_intent == "overwhelm":
+        free_slots_future = _io_pool.submit(get_next_free_slots, count=3)
+
+    # Simple event requests with an explicit time are parsed locally and
+    # skip the model entirely.
+    if keyword_intent == "add_event":
+        rule_based_event = _try_rule_based_parse(user_message, now)
+        if rule_based_event is not None:
+            analysis = {"intent": "add_event", "event": rule_based_event}
+
+    if keyword_intent in ("tabs", "overwhelm", "add_event") and not analysis:
+        try:
+            analysis = classify_and_extract(user_message, now)
+            intent = analysis.get("intent") or keyword_intent
+        except Exception as e:
+            print(f"Intent classification error: {e}")
+            analysis = {}
 
     # -------------------------------------------------
     # 0. EXPLICIT TAB ORGANIZATION REQUESTS
     # -------------------------------------------------
-    tab_triggers = [
-        "organize tabs",
-        "organise tabs",
-        "help with tabs",
-        "relevant tabs",
-        "which tabs",
-        "what tabs",
-        "tabs for",
-        "show tabs",
-        "find tabs for",
-        "help me focus on",
-    ]
-
-    if any(trigger in user_lower for trigger in tab_triggers):
+    if intent == "tabs":
         try:
-            results = get_relevant_tabs_flat(user_message)
+            results = get_relevant_tabs_flat(user_message, core_task=analysis.get("core_task"))
 
             if results.get("error"):
                 return "I couldn't find any synced tabs yet. Try syncing them first."
@@ -149,64 +859,48 @@ def ADHDWiz_respond(user_message: str) -> str:
             print("Tab organization error:", e)
             return "Something went wrong while organizing your tabs."
 
-
-        except Exception as e:
-            print(f"Tab organization error: {e}")
-            # Fall through to normal behavior if something explodes
-            pass
-
     # -------------------------------------------------
     # 1. DETECT TASK OVERWHELM / STARTING CONFUSION
     # -------------------------------------------------
-    overwhelm_triggers = [
-        "don't know where to start",
-        "dont know where to start",
-        "don't know how to start",
-        "dont know how to start",
-        "overwhelmed",
-        "too much",
-        "can't start",
-        "cant start",
-        "stuck",
-        "procrastinating",
-        "need to do",
-        "have to do",
-        "should do",
-        "supposed to",
-        "paralyzed",
-        "paralysed",
-        "freezing",
-        "can't focus on",
-        "cant focus on",
-    ]
-    
-    if any(trigger in user_lower for trigger in overwhelm_triggers):
+    if intent == "overwhelm":
         try:
             # Break task into subtasks
-            breakdown = break_task_into_subtasks(user_message)
+            if analysis.get("subtasks"):
+                breakdown = {
+                    "task_name": analysis.get("task_name") or "this task",
+                    "subtasks": analysis["subtasks"],
+                }
+            else:
+                breakdown = break_task_into_subtasks(user_message)
             
             # Get next available time slots
-            free_slots = get_next_free_slots(count=3)
+            if free_slots_future is not None:
+                free_slots = free_slots_future.result()
+            else:
+                free_slots = get_next_free_slots(count=3)
             
-            # Add each subtask to calendar
+            # Add each subtask to calendar, all inserts in flight at once
+            planned = []
+            for i, subtask in enumerate(breakdown["subtasks"][:len(free_slots)]):
+                slot = free_slots[i]
+                duration = timedelta(minutes=subtask["duration_minutes"])
+                future = _io_pool.submit(
+                    add_event,
+                    summary=f"✅ {subtask['name']}",
+                    start_time=slot.isoformat(),
+                    end_time=(slot + duration).isoformat(),
+                    description=f"Part {i+1} of: {breakdown['task_name']}"
+                )
+                planned.append((future, subtask, slot))
+
             added_events = []
-            for i, subtask in enumerate(breakdown["subtasks"]):
-                if i < len(free_slots):
-                    slot = free_slots[i]
-                    duration = timedelta(minutes=subtask["duration_minutes"])
-                    
-                    event = add_event(
-                        summary=f"✅ {subtask['name']}",
-                        start_time=slot.isoformat(),
-                        end_time=(slot + duration).isoformat(),
-                        description=f"Part {i+1} of: {breakdown['task_name']}"
-                    )
-                    
-                    added_events.append({
-                        "name": subtask["name"],
-                        "time": slot.strftime("%I:%M %p"),
-                        "duration": subtask["duration_minutes"]
-                    })
+            for future, subtask, slot in planned:
+                future.result()
+                added_events.append({
+                    "name": subtask["name"],
+                    "time": slot.strftime("%I:%M %p"),
+                    "duration": subtask["duration_minutes"]
+                })
             
             # Generate encouraging response
             response = f"""
@@ -234,21 +928,9 @@ The rest will follow. You've got this.
     # -------------------------------------------------
     # 2. Detect explicit event creation requests
     # -------------------------------------------------
-    add_event_triggers = [
-        "add event",
-        "create event",
-        "schedule",
-        "remind me",
-        "block time",
-        "put on calendar",
-        "add to calendar",
-        "meeting at",
-        "appointment"
-    ]
-    
-    if any(trigger in user_lower for trigger in add_event_triggers):
+    if intent == "add_event":
         try:
-            event_details = parse_event_from_message(user_message)
+            event_details = analysis.get("event") or parse_event_from_message(user_message, now)
             
             created_event = add_event(
                 summary=event_details["summary"],
@@ -271,92 +953,55 @@ You are all set. Need anything else?
     # -------------------------------------------------
     # 3. Detect schedule queries
     # -------------------------------------------------
-    schedule_triggers = [
-        "what do i have",
-        "what's next",
-        "what is next",
-        "my day",
-        "today",
-        "calendar",
-        "busy",
-        "what am i supposed to do"
-    ]
-
-    if any(trigger in user_lower for trigger in schedule_triggers):
+    if intent == "schedule":
         schedule_text = get_today_schedule()
 
-        prompt = f"""
-        You are ADHDWiz. The user's schedule is:
-
-        {schedule_text}
-
-        Summarize this in a warm, ADHD-friendly tone.
-        Use short paragraphs and reassuring words.
-        """
+        prompt = _SCHEDULE_USER_TEMPLATE.format(schedule_text=schedule_text)
 
-        completion = client.chat.completions.create(
+        request = dict(
             model="gpt-4o-mini",
             messages=[
-                {"role": "system", "content": "You are ADHDWiz, a supportive ADHD coach."},
+                {"role": "system", "content": _SCHEDULE_SYSTEM},
                 {"role": "user", "content": prompt}
             ]
         )
 
-        return completion.choices[0].message.content.strip()
+        if stream:
+            return cached_chat_completion_stream(**request)
+
+        completion = cached_chat_completion(**request)
+
+        content = completion.choices[0].message.content
+        return content and content.strip()
 
     # -------------------------------------------------
     # 4. Normal ADHDWiz chat (no tools)
     # -------------------------------------------------
-    system_prompt = """
-    You are ADHDWiz — a warm, non-judgmental ADHD support assistant.
-    
-    Write in plain text only.
-    Do not use any emojis.
-    Do not use asterisks, bold, italics, markdown, or bullets.
-    Do not use lists or special characters.
-    Avoid symbols like *, -, •, >, _, or fancy formatting.
-
-    Style:
-    - short paragraphs
-    - supportive, casual tone
-    - micro-steps (30–60 seconds)
-    - no shame, lots of validation
-    
-    When users express confusion or overwhelm about tasks, your responses should
-    acknowledge their feelings and offer encouragement.
-    """
+    cached_reply = _chat_semantic_cache.lookup(user_message)
+    if cached_reply is not None:
+        return cached_reply
 
     messages = [
-        {"role": "system", "content": system_prompt},
+        {"role": "system", "content": _CHAT_SYSTEM},
         {"role": "user", "content": user_message}
     ]
 
-    tools = [
-        {
-            "name": "get_relevant_tab_groups",
-            "description": "Find the browser tabs that best support a task and group them by micro-subtasks.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "task_description": {
-                        "type": "string",
-                        "description": "What the user is trying to accomplish. Example: 'Finish my biology lab writeup'."
-                    }
-                },
-                "required": ["task_description"]
-            }
-        }
-    ]
-
-    completion = client.chat.completions.create(
+    request = dict(
         model="gpt-4o-mini",
         messages=messages,
-        functions=tools,
+        functions=_CHAT_FUNCTIONS,
         # IMPORTANT CHANGE: do not auto-call tools anymore
         function_call="none",
         temperature=0.85
     )
 
+    # function_call="none" means the model never calls a tool, so the reply
+    # can be streamed straight through.
+    if stream:
+        return _remember_chat_stream(user_message, cached_chat_completion_stream(**request))
+
+    completion = cached_chat_completion(**request)
+
     first_choice = completion.choices[0].message
 
     # With function_call="none", this block is basically dead code now,
@@ -385,100 +1030,271 @@ You are all set. Need anything else?
                 "content": json.dumps(tool_payload)
             })
 
-            followup = client.chat.completions.create(
+            followup = cached_chat_completion(
                 model="gpt-4o-mini",
                 messages=messages,
                 temperature=0.75
             )
-            return followup.choices[0].message.content.strip()
-
-    return first_choice.content.strip()
-
-
-def generate_study_plan_from_syllabus(syllabus_text: str) -> str:
+            content = followup.choices[0].message.content
+            return content and content.strip()
+
+    reply = first_choice.content and first_choice.content.strip()
+    _chat_semantic_cache.store(user_message, reply)
+    return reply
+
+
+def _remember_chat_stream(user_message: str, chunks):
+    """Pass chunks through, then remember the full reply for near-duplicates."""
+    parts = []
+    for chunk in chunks:
+        parts.append(chunk)
+        yield chunk
+    _chat_semantic_cache.store(user_message, "".join(parts).strip())
+
+
+# -------------------------------------------------
+# SYLLABUS PACKING
+# -------------------------------------------------
+SYLLABUS_TOKEN_BUDGET = 2000
+
+_token_encoding = None
+_token_encoding_loaded = False
+_token_encoding_lock = threading.Lock()
+
+# Words and date shapes that mark the parts of a syllabus a study plan is
+# built from (schedule, topics, deadlines) rather than policy boilerplate.
+_SYLLABUS_SIGNAL_RE = re.compile(
+    r"\b(?:week|weeks|chapter|chapters|unit|units|module|modules|topic|topics|"
+    r"lecture|lectures|reading|readings|exam|exams|midterm|final|quiz|quizzes|"
+    r"assignment|assignments|homework|project|projects|due|deadline|lab|labs|schedule)\b"
+    r"|\b(?:jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec)[a-z]*\.?\s+\d{1,2}\b"
+    r"|\b\d{1,2}/\d{1,2}\b",
+    re.IGNORECASE,
+)
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?])\s+")
+# Budget charged per packed unit on top of its own count: the "\n\n" or
+# space joining it to its neighbours, plus chars/4 rounding.
+_UNIT_JOIN_TOKENS = 2
+
+
+def _get_token_encoding():
+    """
+    tiktoken encoder for gpt-4o-mini, loaded on first use. tiktoken downloads
+    the BPE file the first time, so offline this is None and token counts
+    fall back to a chars/4 estimate.
+    """
+    global _token_encoding, _token_encoding_loaded
+    with _token_encoding_lock:
+        if not _token_encoding_loaded:
+            _token_encoding_loaded = True
+            if tiktoken is not None:
+                try:
+                    try:
+                        _token_encoding = tiktoken.encoding_for_model("gpt-4o-mini")
+                    except KeyError:
+                        _token_encoding = tiktoken.get_encoding("o200k_base")
+                except Exception as err:
+                    print(f"tiktoken unavailable, estimating token counts: {err}")
+    return _token_encoding
+
+
+def _count_tokens(text: str) -> int:
+    encoding = _get_token_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return max(1, len(text) // 4)
+
+
+def _truncate_to_tokens(text: str, limit: int) -> str:
+    """Prefix of text within limit tokens, cut back to a word boundary when there is one."""
+    encoding = _get_token_encoding()
+    if encoding is not None:
+        prefix = encoding.decode(encoding.encode(text)[:limit])
+    else:
+        prefix = text[:limit * 4]
+    if len(prefix) < len(text):
+        head, _, _ = prefix.rpartition(" ")
+        prefix = head or prefix
+    return prefix.strip()
+
+
+def _pack_syllabus(text: str, budget: int = SYLLABUS_TOKEN_BUDGET) -> str:
+    """
+    Fit syllabus text into a token budget, cutting mid-sentence only when
+    nothing else fits. Paragraphs are ranked by how densely they mention
+    schedule/topic signals, packed greedily, then emitted in their original
+    order. Budget left over goes to a prefix of the best unit that did not
+    fit, so one huge unbroken block (typical of PDF text) is never dropped.
+    """
+    if not text or _count_tokens(text) <= budget:
+        return text
+
+    paragraphs = [p.strip() for p in re.split(r"\n\s*\n", text) if p.strip()]
+    if len(paragraphs) <= 1:
+        # PDF extraction often loses blank lines; fall back to single lines.
+        paragraphs = [line.strip() for line in text.splitlines() if line.strip()]
+
+    # (paragraph number, text); long paragraphs become one unit per sentence.
+    units = []
+    for number, paragraph in enumerate(paragraphs):
+        if _count_tokens(paragraph) > budget // 4:
+            units.extend((number, s) for s in _SENTENCE_SPLIT_RE.split(paragraph) if s)
+        else:
+            units.append((number, paragraph))
+
+    ranked = []
+    for index, (_, unit) in enumerate(units):
+        tokens = _count_tokens(unit)
+        density = len(_SYLLABUS_SIGNAL_RE.findall(unit)) / tokens
+        ranked.append((-density, index, tokens))
+    ranked.sort()
+
+    # Each chosen unit is also charged for the separator joining it to the
+    # rest, and for rounding in the chars/4 estimate.
+    chosen = []
+    skipped = []
+    used = 0
+    for _, index, tokens in ranked:
+        cost = tokens + _UNIT_JOIN_TOKENS
+        if used + cost <= budget:
+            chosen.append(index)
+            used += cost
+        else:
+            skipped.append(index)
+
+    if skipped and used + _UNIT_JOIN_TOKENS < budget:
+        index = skipped[0]
+        number, unit = units[index]
+        prefix = _truncate_to_tokens(unit, budget - used - _UNIT_JOIN_TOKENS)
+        if prefix:
+            units[index] = (number, prefix)
+            chosen.append(index)
+
+    # Sentences from the same paragraph are rejoined with a space.
+    paragraphs_out = []
+    last_number = None
+    for index in sorted(chosen):
+        number, unit = units[index]
+        if number == last_number:
+            paragraphs_out[-1] += " " + unit
+        else:
+            paragraphs_out.append(unit)
+            last_number = number
+
+    packed = "\n\n".join(paragraphs_out)
+    if not packed:
+        return _truncate_to_tokens(text, budget)
+    if _count_tokens(packed) > budget:
+        # Tokenizer merges across joins can still add a token here and there.
+        packed = _truncate_to_tokens(packed, budget)
+    return packed
+
+
+def generate_study_plan_from_syllabus(syllabus_text: str, precompute: bool = False) -> str:
     """
     Produce an ADHD-friendly study plan derived from syllabus text.
+    With precompute=True the request is queued for the Batch API and the
+    batch custom_id is returned instead of the plan.
     """
-    context = (syllabus_text or "").strip()
-    if len(context) > 6000:
-        context = context[:6000]
+    context = _pack_syllabus((syllabus_text or "").strip())
 
-    prompt = f"""
-You are ADHDWiz, a compassionate focus coach.
+    prompt = _STUDY_PLAN_USER_TEMPLATE.format(syllabus=context or _EMPTY_SYLLABUS_NOTE)
 
-Create a motivational week-by-week study roadmap from the syllabus notes below.
-Each week should include:
-- Theme or chapter focus
-- 2-3 micro-actions (prefer verbs)
-- Estimated total hours
-- Tiny accountability or reward idea
+    messages = [
+        {"role": "system", "content": _STUDY_PLAN_SYSTEM},
+        {"role": "user", "content": prompt}
+    ]
 
-If info is missing, infer reasonable topics and keep it 6-8 weeks long.
+    if precompute:
+        return enqueue_for_batch(messages, temperature=0.4)
 
-Syllabus notes:
-\"\"\"{context or "No syllabus text was provided. Build a balanced 6-week plan for a college course."}\"\"\"
-"""
-
-    response = client.chat.completions.create(
+    response = cached_chat_completion(
         model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "You design concise, ADHD-friendly study roadmaps."},
+        messages=messages,
+        temperature=0.4
+    )
+
+    content = response.choices[0].message.content
+    return content and content.strip()
+
+
+def enqueue_schedule_summary(day: date = None, custom_id: str = None) -> str:
+    """
+    Queue a summary of one day's full schedule for the Batch API (e.g. from
+    a nightly job preparing good-morning messages). day defaults to
+    tomorrow. Returns the batch custom_id.
+    """
+    day = day or date.today() + timedelta(days=1)
+    prompt = _SCHEDULE_USER_TEMPLATE.format(schedule_text=get_day_schedule(day))
+    return enqueue_for_batch(
+        [
+            {"role": "system", "content": _SCHEDULE_SYSTEM},
             {"role": "user", "content": prompt}
         ],
-        temperature=0.4
+        custom_id=custom_id,
     )
 
-    return response.choices[0].message.content.strip()
+
+# Request phrasing that surrounds the actual topic in tab/study requests.
+# Matched case-insensitively and removed by extract_core_task.
+_CORE_TASK_NOISE_RE = re.compile(
+    r"""
+    \b(?:hey|hi|hello|please|pls|adhdwiz|thanks|thank\s+you)\b
+    | \b(?:can|could|would|will)\s+you\b
+    | \b(?:find|show|organi[sz]e|open|group|pull\s+up|get|sort)\s+(?:me\s+)?
+      (?:(?:my|the|all|some|any)\s+)?(?:relevant\s+|useful\s+)?tabs?\b
+    | \b(?:which|what)\s+tabs?\b
+      (?:\s+(?:should|do|can|could)\s+i\s+(?:use|open|look\s+at|need|keep))?
+    | \b(?:relevant|useful|my|the)\s+tabs?\b
+    | \btabs?\b
+    | \bhelp\s+(?:me\s+)?(?:to\s+)?
+      (?:focus\s+on|study|work\s+on|prep(?:are)?|get\s+started\s+on|start|with)?
+    | \bi\s+(?:really\s+)?(?:need|have|want|got)\s+to\s+
+      (?:study|work\s+on|finish|do|prep(?:are)?|start|review|focus\s+on)?
+    | \bi(?:'m|\s+am)\s+(?:studying|working\s+on|preparing|prepping|reviewing)
+    | \b(?:studying|working\s+on|preparing|prepping|reviewing)\b
+    """,
+    re.IGNORECASE | re.VERBOSE,
+)
+
+# Connecting words left at either edge once the phrasing above is gone
+# ("for my stats homework"). Inside the topic they are part of it
+# ("intro to algorithms", "notes on Kant"), so only the edges are trimmed.
+_CORE_TASK_EDGE_RE = re.compile(
+    r"^(?:(?:related\s+to|relevant\s+to|about|for|on|with|my|the|some|to)\b\s*)+"
+    r"|(?:\s*\b(?:related\s+to|relevant\s+to|about|for|on|with|my|the|some|to))+$",
+    re.IGNORECASE,
+)
 
 
 def extract_core_task(user_message: str) -> str:
     """
     Extract the actual study/task topic from natural language.
-    Uses GPT to strip away phrases like:
+    Strips away phrases like:
     - "find tabs for"
     - "organize tabs for"
     - "help me with"
     - "I need to study"
     
-    Returns only the keywords describing the academic task.
+    Returns only the keywords describing the academic task, or the
+    original message when nothing is left after stripping.
     """
+    raw = (user_message or "").strip()
+    topic = _CORE_TASK_NOISE_RE.sub(" ", raw)
+    topic = " ".join(topic.split()).strip(" .,!?;:-'\"")
+    topic = _CORE_TASK_EDGE_RE.sub("", topic).strip(" .,!?;:-'\"")
+    return topic or raw
 
-    prompt = f"""
-    Extract ONLY the core academic or study topic from this message:
-    "{user_message}"
-
-    Rules:
-    - Remove phrases like "find tabs for", "organize tabs", "help with", etc.
-    - Return ONLY the subject/topic, not a full sentence.
-    - Keep it short: 3–8 words max.
-    - Examples:
-        "find tabs for linear algebra midterm" -> "linear algebra midterm"
-        "help me study for biology exam" -> "biology exam"
-        "organize tabs for my stats homework" -> "statistics homework"
-        "what tabs should I use for discrete structures" -> "discrete structures"
-    - Respond with plain text only (no JSON).
-    """
-
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "Extract the clean academic topic only."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0.2
-    )
-
-    return response.choices[0].message.content.strip()
 
-def get_relevant_tabs_flat(task_description: str) -> dict:
+def get_relevant_tabs_flat(task_description: str, core_task: str = None) -> dict:
     raw = (task_description or "").strip()
 
     if not retriever_has_tabs():
         return {"task": raw, "tabs": [], "error": "No synced tabs available."}
 
     try:
-        # STEP 1 — Extract clean academic task
-        core_task = extract_core_task(raw)
+        # STEP 1 — Extract clean academic task (unless the caller already has it)
+        core_task = (core_task or "").strip() or extract_core_task(raw)
 
         # STEP 2 — perform semantic search
         from tabs_retriever import _retriever
@@ -487,10 +1303,7 @@ def get_relevant_tabs_flat(task_description: str) -> dict:
         # IMPORTANT — Pull tabId from original tab list
         flat_results = []
         for m in matches:
-            for t in _retriever.tabs:
-                if t["url"] == m["url"]:    # match exact tab
-                    m["id"] = t.get("id")    # append tabId for grouping
-                    break
+            m["id"] = _retriever.tabs_by_url.get(m["url"], {}).get("id")    # append tabId for grouping
             flat_results.append(m)
 
         return {
@@ -1,27 +1,90 @@
-from flask import Flask, request, jsonify, send_file, session, redirect
+from flask import Flask, request, jsonify, send_file, session, redirect, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import speech_recognition as sr
-import tempfile
 import subprocess
 import os
 import io
+import json
+import hashlib
+import re
+import threading
 import textwrap
+from datetime import date
+from pathlib import Path
 from gtts import gTTS
 from dotenv import load_dotenv
-from agent import ADHDWiz_respond, generate_study_plan_from_syllabus
+from agent import (
+    ADHDWiz_respond, enqueue_schedule_summary, generate_study_plan_from_syllabus,
+    get_batch_reply, get_relevant_tabs_flat,
+)
+from calendar_tool import add_event
 from tabs_retriever import sync_tabs_snapshot
+from tts_cache import SpeechCache
 from google_auth_oauthlib.flow import Flow
 from google.oauth2.credentials import Credentials
 
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
 try:
     from PyPDF2 import PdfReader
 except ImportError:
     PdfReader = None
 
+try:
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+except ImportError:
+    canvas = None
+
+try:
+    import av
+except ImportError:
+    av = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import numpy as np
+    from faster_whisper import WhisperModel
+except ImportError:
+    WhisperModel = None
+
 
 load_dotenv()
 
+class OrjsonProvider(DefaultJSONProvider):
+    """jsonify/get_json through orjson, with Flask's encoder for anything orjson rejects."""
+
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_NON_STR_KEYS
+        if kwargs.get("sort_keys", self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, option=option).decode("utf-8")
+        except TypeError:
+            return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError:
+            # orjson refuses lone surrogates such as "\ud83d" left by the
+            # extension cutting page text mid-emoji; the stdlib accepts them.
+            return super().loads(s, **kwargs)
+
+
 app = Flask(__name__)
+if orjson is not None:
+    app.json = OrjsonProvider(app)
 CORS(app, supports_credentials=True)
 
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "dev-secret-change-me")
@@ -32,40 +95,223 @@ GOOGLE_CLIENT_SECRETS_FILE = "credentials.json"
 GOOGLE_SCOPES = ["https://www.googleapis.com/auth/calendar"]
 GOOGLE_REDIRECT_URI = "http://localhost:5050/calendar/oauth2callback"
 
+# Parsed once so each OAuth hop doesn't re-read credentials.json.
+try:
+    with open(GOOGLE_CLIENT_SECRETS_FILE) as secrets_file:
+        GOOGLE_CLIENT_CONFIG = json.load(secrets_file)
+except FileNotFoundError:
+    GOOGLE_CLIENT_CONFIG = None
+
+
+def _oauth_flow(state=None):
+    if GOOGLE_CLIENT_CONFIG is None:
+        # Surfaces the usual "file not found" error to the OAuth pages.
+        return Flow.from_client_secrets_file(
+            GOOGLE_CLIENT_SECRETS_FILE,
+            scopes=GOOGLE_SCOPES,
+            redirect_uri=GOOGLE_REDIRECT_URI,
+            state=state,
+        )
+    return Flow.from_client_config(
+        GOOGLE_CLIENT_CONFIG,
+        scopes=GOOGLE_SCOPES,
+        redirect_uri=GOOGLE_REDIRECT_URI,
+        state=state,
+    )
+
+TRANSCRIBE_SAMPLE_RATE = 16000
+
+# Repeated phrases ("Let me think...", error acknowledgements) are served
+# from disk instead of another round trip to Google's TTS endpoint.
+_speech_cache = SpeechCache(Path(__file__).resolve().parent / "tts_cache")
 
-def convert_webm_to_wav(webm_path, wav_path):
-    """Convert WebM → WAV using ffmpeg"""
-    subprocess.run([
-        "ffmpeg", "-y",
-        "-i", webm_path,
+# Speech is synthesized and cached per sentence so playback can start on
+# the first one; later sentences are fetched in parallel meanwhile.
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
+_tts_pool = ThreadPoolExecutor(max_workers=4)
+
+# Speech depends only on the text, so clients may keep it; study plans
+# are per-user and stay in the private cache.
+SPEECH_CACHE_CONTROL = "public, max-age=3600, immutable"
+STUDY_PLAN_CACHE_CONTROL = "private, max-age=3600"
+
+
+def _synthesize_sentence(sentence: str, lang: str = 'en') -> bytes:
+    cache_key = SpeechCache.make_key(sentence, lang)
+    audio = _speech_cache.get(cache_key)
+    if audio is None:
+        audio = b"".join(gTTS(text=sentence, lang=lang).stream())
+        _speech_cache.put(cache_key, audio)
+    return audio
+
+
+def speech_chunks(text: str, lang: str = 'en'):
+    """Yield MP3 bytes sentence by sentence, in order."""
+    sentences = [part for part in _SENTENCE_END_RE.split(text.strip()) if part]
+    futures = [_tts_pool.submit(_synthesize_sentence, sentence, lang) for sentence in sentences]
+    try:
+        for future in futures:
+            yield future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def _sentences_from_chunks(chunks):
+    """Regroup streamed text chunks into complete sentences."""
+    buffer = ""
+    for chunk in chunks:
+        buffer += chunk
+        *sentences, buffer = _SENTENCE_END_RE.split(buffer)
+        for sentence in sentences:
+            if sentence.strip():
+                yield sentence
+    if buffer.strip():
+        yield buffer
+
+
+def convert_webm_to_pcm(webm_bytes: bytes) -> bytes:
+    """Convert WebM → 16 kHz mono 16-bit PCM using ffmpeg over pipes"""
+    result = subprocess.run([
+        "ffmpeg",
+        "-i", "pipe:0",
         "-ac", "1",
-        "-ar", "16000",
-        wav_path
-    ], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        "-ar", str(TRANSCRIBE_SAMPLE_RATE),
+        "-f", "s16le",
+        "pipe:1"
+    ], input=webm_bytes, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    return result.stdout
+
+
+
+WHISPER_MODEL_NAME = os.getenv("WHISPER_MODEL", "small.en")
+_whisper_model = None
+_whisper_failed = False
+_whisper_lock = threading.Lock()
+
+
+def _get_whisper_model():
+    """
+    faster-whisper model, loaded on first use and shared by every request.
+    None if it isn't installed or couldn't be loaded (e.g. the model
+    download failed); a failed load isn't retried.
+    """
+    global _whisper_model, _whisper_failed
+    if WhisperModel is None:
+        return None
+    with _whisper_lock:
+        if _whisper_model is None and not _whisper_failed:
+            try:
+                _whisper_model = WhisperModel(WHISPER_MODEL_NAME, device="cpu", compute_type="int8")
+            except Exception as err:
+                _whisper_failed = True
+                print(f"Whisper model load error, using Google speech recognition: {err}")
+    return _whisper_model
+
+
+def recognize_speech(recognizer, audio_data) -> str:
+    """
+    Transcribe on-device with faster-whisper when its model is available,
+    otherwise through Google's Web Speech endpoint. Raises
+    sr.UnknownValueError when nothing intelligible was said, like
+    recognize_google does.
+    """
+    model = _get_whisper_model()
+    if model is None:
+        return recognizer.recognize_google(audio_data)
+
+    pcm = audio_data.get_raw_data(convert_rate=TRANSCRIBE_SAMPLE_RATE, convert_width=2)
+    samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+    segments, _ = model.transcribe(
+        samples, language="en", vad_filter=True, beam_size=1
+    )
+    text = " ".join(segment.text.strip() for segment in segments).strip()
+    if not text:
+        raise sr.UnknownValueError()
+    return text
+
+
+def decode_audio_to_pcm(audio_stream) -> bytes:
+    """
+    Decode an uploaded WebM/Opus clip in-process with PyAV and return
+    16 kHz mono 16-bit PCM, ready for sr.AudioData.
+    """
+    resampler = av.AudioResampler(format="s16", layout="mono", rate=TRANSCRIBE_SAMPLE_RATE)
+    chunks = []
+
+    def collect(frames):
+        # PyAV < 9 returns a single frame (or None) instead of a list.
+        if frames is None:
+            return
+        if not isinstance(frames, list):
+            frames = [frames]
+        for frame in frames:
+            # Planes can be padded past the last sample; keep 2 bytes per sample.
+            chunks.append(bytes(frame.planes[0])[:frame.samples * 2])
+
+    with av.open(io.BytesIO(audio_stream.read())) as container:
+        for frame in container.decode(audio=0):
+            collect(resampler.resample(frame))
+    collect(resampler.resample(None))
+
+    return b"".join(chunks)
 
 
 # ---------------------------------------------------------------
 # FIX 1: Helper to remove emojis / non-latin1 safely
 # ---------------------------------------------------------------
+_NON_LATIN1_RE = re.compile(r"[^\x00-\xff]")
+_PDF_ESCAPES = str.maketrans({"\\": "\\\\", "(": "\\(", ")": "\\)"})
+
+
 def _to_latin1_safe(value: str) -> str:
     """
     Ensure value can be encoded in latin-1 by replacing unsupported characters
     (e.g., emoji) with '?'.
     """
-    return value.encode("latin-1", "replace").decode("latin-1")
+    return _NON_LATIN1_RE.sub("?", value)
+
 
+def _extract_text_with_pdfium(pdf_file) -> str:
+    pdf = pdfium.PdfDocument(pdf_file)
+    try:
+        pages_text = []
+        for page in pdf:
+            textpage = page.get_textpage()
+            try:
+                pages_text.append(textpage.get_text_range())
+            finally:
+                textpage.close()
+                page.close()
+        return "\n".join(pages_text)
+    finally:
+        pdf.close()
 
-def extract_text_from_pdf(file_bytes: bytes) -> str:
+
+def extract_text_from_pdf(pdf_file) -> str:
     """
-    Attempt to extract raw text from a PDF using PyPDF2 if available.
+    Attempt to extract raw text from a PDF, preferring pypdfium2 (PDFium's
+    native extractor) and falling back to PyPDF2 if available.
+    pdf_file is a seekable binary file object such as an upload's stream,
+    so the upload is parsed in place instead of being copied into memory.
     """
-    if not file_bytes or PdfReader is None:
-        if PdfReader is None:
-            print("PyPDF2 not installed; returning empty syllabus text.")
+    is_empty = pdf_file.seek(0, io.SEEK_END) == 0
+    pdf_file.seek(0)
+
+    if not is_empty and pdfium is not None:
+        try:
+            return _extract_text_with_pdfium(pdf_file)
+        except Exception as err:
+            print(f"pypdfium2 extraction error: {err}")
+            pdf_file.seek(0)
+
+    if is_empty or PdfReader is None:
+        if PdfReader is None and pdfium is None:
+            print("No PDF library installed; returning empty syllabus text.")
         return ""
 
     try:
-        reader = PdfReader(io.BytesIO(file_bytes))
+        reader = PdfReader(pdf_file)
         pages_text = []
         for page in reader.pages:
             try:
@@ -82,33 +328,65 @@ def _escape_pdf_text(value: str) -> str:
     """
     Escape characters for PDF text drawing AND ensure latin1 safe.
     """
-    value = _to_latin1_safe(value)
-    return value.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    return _to_latin1_safe(value).translate(_PDF_ESCAPES)
 
 
-def render_plan_pdf(plan_text: str) -> bytes:
-    """
-    Build a very small PDF document containing the study plan text.
-    """
-    cleaned_text = plan_text.strip() or "Study plan could not be generated."
+# Page layout shared by the reportlab and hand-built renderers.
+PDF_LINES_PER_PAGE = 40
+PDF_LEFT_MARGIN = 72
+PDF_START_HEIGHT = 760
+PDF_LINE_HEIGHT = 16
+
+# Built once; textwrap.wrap() would construct a new TextWrapper per paragraph.
+_PDF_WRAPPER = textwrap.TextWrapper(width=90)
 
-    # Ensure whole content is latin1-encodable
-    cleaned_text = _to_latin1_safe(cleaned_text)
 
+def _wrap_plan_lines(cleaned_text: str) -> list:
     wrapped_lines = []
     for paragraph in cleaned_text.splitlines():
         if paragraph.strip() == "":
             wrapped_lines.append("")
             continue
-        wrapped_lines.extend(textwrap.wrap(paragraph, width=90) or [""])
+        wrapped_lines.extend(_PDF_WRAPPER.wrap(paragraph) or [""])
 
     if not wrapped_lines:
         wrapped_lines = ["Study plan could not be generated."]
+    return wrapped_lines
+
+
+def render_plan_pdf(plan_text: str) -> io.BytesIO:
+    """
+    Build a very small PDF document containing the study plan text,
+    returned as a buffer rewound to the start. Uses reportlab (compressed streams, WinAnsi text) when installed.
+    """
+    cleaned_text = plan_text.strip() or "Study plan could not be generated."
 
-    lines_per_page = 40
+    if canvas is not None:
+        return _render_plan_pdf_reportlab(_wrap_plan_lines(cleaned_text))
+
+    # Ensure whole content is latin1-encodable
+    return _render_plan_pdf_by_hand(_wrap_plan_lines(_to_latin1_safe(cleaned_text)))
+
+
+def _render_plan_pdf_reportlab(wrapped_lines: list) -> io.BytesIO:
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=letter)
+    for i in range(0, len(wrapped_lines), PDF_LINES_PER_PAGE):
+        text = pdf.beginText(PDF_LEFT_MARGIN, PDF_START_HEIGHT)
+        text.setFont("Helvetica", 12, leading=PDF_LINE_HEIGHT)
+        for line in wrapped_lines[i:i + PDF_LINES_PER_PAGE]:
+            text.textLine(line)
+        pdf.drawText(text)
+        pdf.showPage()
+    pdf.save()
+    buffer.seek(0)
+    return buffer
+
+
+def _render_plan_pdf_by_hand(wrapped_lines: list) -> io.BytesIO:
     pages = [
-        wrapped_lines[i:i + lines_per_page]
-        for i in range(0, len(wrapped_lines), lines_per_page)
+        wrapped_lines[i:i + PDF_LINES_PER_PAGE]
+        for i in range(0, len(wrapped_lines), PDF_LINES_PER_PAGE)
     ]
 
     next_obj_id = 1
@@ -142,28 +420,25 @@ def render_plan_pdf(plan_text: str) -> bytes:
     # font
     set_object(font_id, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
 
-    left_margin = 72
-    start_height = 760
-    line_height = 16
+    left_margin = PDF_LEFT_MARGIN
+    start_height = PDF_START_HEIGHT
+    line_height = PDF_LINE_HEIGHT
+
+    page_header = f"BT\n/F1 12 Tf\n{left_margin} {start_height} Td\n".encode("ascii")
+    next_line = f"\n0 -{line_height} Td\n".encode("ascii")
 
     for page_id, content_id, lines in page_entries:
-        buffer_lines = [
-            "BT",
-            "/F1 12 Tf",
-            f"{left_margin} {start_height} Td",
+        # Lines are already latin-1 safe, so each one encodes straight to
+        # bytes and the page stream is assembled with a single join.
+        shown_lines = [
+            b"(" + _escape_pdf_text(line).encode("latin-1") + b") Tj"
+            for line in lines
         ]
-        first_line = True
-        for line in lines:
-            if not first_line:
-                buffer_lines.append(f"0 -{line_height} Td")
-            else:
-                first_line = False
-            safe_line = _escape_pdf_text(line)
-            buffer_lines.append(f"({safe_line}) Tj")
-        buffer_lines.append("ET")
-
-        stream_text = "\n".join(buffer_lines)
-        stream_data = stream_text.encode("latin-1", "replace")
+        stream_data = b"".join((
+            page_header,
+            next_line.join(shown_lines),
+            b"\nET",
+        ))
 
         content_stream = (
             f"<< /Length {len(stream_data)} >>\nstream\n".encode("latin-1") +
@@ -205,7 +480,8 @@ def render_plan_pdf(plan_text: str) -> bytes:
     )
     pdf_buffer.write(f"startxref\n{xref_position}\n%%EOF".encode("ascii"))
 
-    return pdf_buffer.getvalue()
+    pdf_buffer.seek(0)
+    return pdf_buffer
 
 
 # --------------------------------------------------------------------------------
@@ -224,20 +500,15 @@ def transcribe_audio():
             return jsonify({"error": "No audio file"}), 400
 
         audio_file = request.files['audio']
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.webm') as temp_webm:
-            audio_file.save(temp_webm.name)
-            webm_path = temp_webm.name
-
-        wav_path = webm_path.replace('.webm', '.wav')
-        convert_webm_to_wav(webm_path, wav_path)
-
         recognizer = sr.Recognizer()
-        with sr.AudioFile(wav_path) as source:
-            audio_data = recognizer.record(source)
-            text = recognizer.recognize_google(audio_data)
 
-        os.unlink(webm_path)
-        os.unlink(wav_path)
+        if av is not None:
+            pcm = decode_audio_to_pcm(audio_file.stream)
+        else:
+            pcm = convert_webm_to_pcm(audio_file.read())
+
+        audio_data = sr.AudioData(pcm, TRANSCRIBE_SAMPLE_RATE, 2)
+        text = recognize_speech(recognizer, audio_data)
 
         return jsonify({"text": text})
 
@@ -259,7 +530,6 @@ def chat():
         ai_text = ADHDWiz_respond(msg)
 
         # Get tab suggestions (includes tab.id)
-        from agent import get_relevant_tabs_flat
         tab_data = get_relevant_tabs_flat(msg)
 
         # Return BOTH text + tabs
@@ -274,6 +544,53 @@ def chat():
         return jsonify({"response": "Oops—ADHDWiz lost the thread 😅 try again?"})
 
 
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Stream the ADHDWiz reply as plain text while it is being generated."""
+    msg = (request.get_json(silent=True) or {}).get("message", "")
+    if not msg:
+        return jsonify({"response": "No message received."})
+
+    def generate():
+        try:
+            for chunk in ADHDWiz_respond(msg, stream=True):
+                yield chunk
+        except Exception as e:
+            print("AI stream error:", e)
+            yield "Oops—ADHDWiz lost the thread 😅 try again?"
+
+    return Response(stream_with_context(generate()), mimetype="text/plain; charset=utf-8")
+
+
+@app.route('/chat-speak', methods=['POST'])
+def chat_speak():
+    """
+    Stream the spoken ADHDWiz reply as MP3. Each sentence goes to TTS as
+    soon as the model finishes it, so speech starts after the first
+    sentence instead of after the whole reply plus a separate /speak call.
+    """
+    msg = (request.get_json(silent=True) or {}).get("message", "")
+    if not msg:
+        return jsonify({"response": "No message received."})
+
+    def generate():
+        pending = deque()
+        try:
+            for sentence in _sentences_from_chunks(ADHDWiz_respond(msg, stream=True)):
+                pending.append(_tts_pool.submit(_synthesize_sentence, sentence))
+                # Send whatever is already synthesized without stalling the LLM stream.
+                while pending and pending[0].done():
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        except Exception as e:
+            print("Chat-speak error:", e)
+            for future in pending:
+                future.cancel()
+
+    return Response(stream_with_context(generate()), mimetype='audio/mpeg')
+
+
 @app.route('/tabs/sync', methods=['POST'])
 def sync_tabs():
     """Store the latest snapshot of open tabs for retrieval."""
@@ -297,28 +614,72 @@ def study_plan():
         if not upload:
             return jsonify({"error": "Missing syllabus PDF."}), 400
 
-        pdf_bytes = upload.read()
-        syllabus_text = extract_text_from_pdf(pdf_bytes)
+        syllabus_text = extract_text_from_pdf(upload.stream)
+
+        # precompute=1 queues the plan for the Batch API at half the price;
+        # fetch it later from /batch/<custom_id>.
+        if request.form.get("precompute") in ("1", "true"):
+            custom_id = generate_study_plan_from_syllabus(
+                syllabus_text or upload.filename or "", precompute=True
+            )
+            return jsonify({"status": "queued", "custom_id": custom_id}), 202
+
         plan_text = generate_study_plan_from_syllabus(
             syllabus_text or upload.filename or ""
         )
 
         plan_pdf = render_plan_pdf(plan_text)
+        with plan_pdf.getbuffer() as pdf_view:
+            etag = hashlib.sha256(pdf_view).hexdigest()
 
-        buffer = io.BytesIO(plan_pdf)
-        buffer.seek(0)
-        return send_file(
-            buffer,
+        response = send_file(
+            plan_pdf,
             mimetype="application/pdf",
             as_attachment=True,
-            download_name="study-plan.pdf"
+            download_name="study-plan.pdf",
+            conditional=True,
+            etag=etag
         )
+        response.headers["Cache-Control"] = STUDY_PLAN_CACHE_CONTROL
+        return response
 
     except Exception as e:
         print(f"Study plan generation error: {e}")
         return jsonify({"error": "Could not generate study plan."}), 500
 
 
+@app.route('/schedule-summary/precompute', methods=['POST'])
+def precompute_schedule_summary():
+    """
+    Queue a Batch API summary of one day's schedule, e.g. from a nightly
+    cron job. Body: {"date": "YYYY-MM-DD"} (optional, defaults to tomorrow).
+    """
+    try:
+        day_text = (request.get_json(silent=True) or {}).get("date")
+        try:
+            day = date.fromisoformat(day_text) if day_text else None
+        except (TypeError, ValueError):
+            return jsonify({"error": "date must be YYYY-MM-DD."}), 400
+        custom_id = enqueue_schedule_summary(day)
+        return jsonify({"status": "queued", "custom_id": custom_id}), 202
+    except Exception as e:
+        print(f"Schedule summary queue error: {e}")
+        return jsonify({"error": "Could not queue schedule summary."}), 500
+
+
+@app.route('/batch/<custom_id>', methods=['GET'])
+def batch_result(custom_id):
+    """Reply for a request queued through the Batch API; 202 until it is ready."""
+    try:
+        reply = get_batch_reply(custom_id)
+        if reply is None:
+            return jsonify({"status": "pending"}), 202
+        return jsonify({"status": "done", "response": reply})
+    except Exception as e:
+        print(f"Batch result error: {e}")
+        return jsonify({"error": "Could not read batch result."}), 500
+
+
 @app.route('/speak', methods=['POST'])
 def text_to_speech():
     try:
@@ -328,12 +689,25 @@ def text_to_speech():
         if not text:
             return jsonify({"error": "No text provided"}), 400
 
-        tts = gTTS(text=text, lang='en')
-        buffer = io.BytesIO()
-        tts.write_to_fp(buffer)
-        buffer.seek(0)
+        # Same key as the server-side cache, so any client that already has
+        # this text's audio can revalidate without it being synthesized.
+        etag = SpeechCache.make_key(text, 'en')
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            chunks = speech_chunks(text)
+            # Pull the first sentence here so a gTTS failure still gets a 500.
+            first = next(chunks, b"")
+
+            def generate():
+                yield first
+                yield from chunks
+
+            response = Response(stream_with_context(generate()), mimetype='audio/mpeg')
 
-        return send_file(buffer, mimetype='audio/mpeg')
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = SPEECH_CACHE_CONTROL
+        return response
 
     except Exception as e:
         print("TTS Error:", e)
@@ -343,11 +717,7 @@ def text_to_speech():
 @app.route("/calendar/auth")
 def calendar_auth():
     try:
-        flow = Flow.from_client_secrets_file(
-            GOOGLE_CLIENT_SECRETS_FILE,
-            scopes=GOOGLE_SCOPES,
-            redirect_uri=GOOGLE_REDIRECT_URI,
-        )
+        flow = _oauth_flow()
 
         authorization_url, state = flow.authorization_url(
             access_type="offline",
@@ -373,12 +743,7 @@ def calendar_oauth2callback():
                 "<a href='/calendar/auth'>/calendar/auth</a></p>"
             ), 400
 
-        flow = Flow.from_client_secrets_file(
-            GOOGLE_CLIENT_SECRETS_FILE,
-            scopes=GOOGLE_SCOPES,
-            redirect_uri=GOOGLE_REDIRECT_URI,
-            state=state,
-        )
+        flow = _oauth_flow(state=state)
 
         flow.fetch_token(authorization_response=request.url)
         creds = flow.credentials
@@ -402,8 +767,6 @@ def calendar_oauth2callback():
 @app.route('/calendar/add-event', methods=['POST'])
 def add_calendar_event():
     try:
-        from calendar_tool import add_event
-
         data = request.json
         summary = data.get('summary')
         start = data.get('start')
@@ -1,14 +1,53 @@
 import os
 import json
-from datetime import datetime, timezone, timedelta
+import threading
+import time
+from datetime import datetime, timezone, timedelta, date
 
 from googleapiclient.discovery import build
+from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 
 SCOPES = ["https://www.googleapis.com/auth/calendar"]
 TOKEN_PATH = "token.json"
 CREDENTIALS_PATH = "credentials.json"
 
+# Read-only lookups are memoized briefly so a chatty session asking
+# "what's next?" several times a minute doesn't hit Google every turn.
+# add_event clears the memo so freshly booked time never shows as free.
+CALENDAR_CACHE_TTL_SECONDS = 60
+_calendar_cache = {}
+_calendar_cache_lock = threading.Lock()
+
+
+def _cache_get(key):
+    with _calendar_cache_lock:
+        entry = _calendar_cache.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del _calendar_cache[key]
+            return None
+        return value
+
+
+def _cache_put(key, value):
+    with _calendar_cache_lock:
+        _calendar_cache[key] = (value, time.monotonic() + CALENDAR_CACHE_TTL_SECONDS)
+
+
+# Built services are reused until token.json changes. httplib2 connections
+# are not thread-safe and agent._io_pool books events in parallel, so each
+# thread keeps its own service.
+_service_local = threading.local()
+
+
+def invalidate_calendar_cache():
+    """Forget memoized schedule and free-slot lookups."""
+    with _calendar_cache_lock:
+        _calendar_cache.clear()
+
 
 def _load_credentials():
     """Load saved user credentials from token.json, if they exist and are valid."""
@@ -19,6 +58,13 @@ def _load_credentials():
         )
 
     creds = Credentials.from_authorized_user_file(TOKEN_PATH, SCOPES)
+    if creds and creds.expired and creds.refresh_token:
+        try:
+            creds.refresh(Request())
+            with open(TOKEN_PATH, "w") as token_file:
+                token_file.write(creds.to_json())
+        except Exception as err:
+            print(f"Calendar token refresh error: {err}")
     if not creds or not creds.valid:
         raise RuntimeError(
             "Your Google Calendar login expired. "
@@ -29,8 +75,23 @@ def _load_credentials():
 
 def get_calendar_service():
     """Return an authenticated Google Calendar service using saved credentials."""
+    try:
+        token_mtime = os.path.getmtime(TOKEN_PATH)
+    except OSError:
+        token_mtime = None
+
+    service = getattr(_service_local, "service", None)
+    if service is not None and token_mtime == _service_local.token_mtime:
+        return service
+
     creds = _load_credentials()
-    service = build("calendar", "v3", credentials=creds)
+    service = build(
+        "calendar", "v3", credentials=creds,
+        cache_discovery=False, static_discovery=True,
+    )
+    _service_local.service = service
+    # A refresh rewrites token.json, so read the mtime again after loading.
+    _service_local.token_mtime = os.path.getmtime(TOKEN_PATH)
     return service
 
 
@@ -39,6 +100,11 @@ def get_today_schedule() -> str:
     Return today's remaining events in a human-readable string.
     If not authorized, returns a message telling the user how to connect.
     """
+    cache_key = ("today_schedule", date.today())
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        return cached
+
     try:
         service = get_calendar_service()
     except RuntimeError as e:
@@ -65,20 +131,56 @@ def get_today_schedule() -> str:
     events = events_result.get("items", [])
 
     if not events:
-        return "You have no events for the rest of today. 💆‍♀️"
+        summary = "You have no events for the rest of today. 💆‍♀️"
+    else:
+        summary = _format_events(events)
+    _cache_put(cache_key, summary)
+    return summary
 
+
+def get_day_schedule(day: date) -> str:
+    """
+    Return every event on the given local calendar day, including ones
+    already over, in the same format as get_today_schedule. Meant for
+    summaries prepared ahead of time (e.g. tonight, for tomorrow morning).
+    """
+    try:
+        service = get_calendar_service()
+    except RuntimeError as e:
+        return str(e)
+
+    start_of_day = datetime(day.year, day.month, day.day).astimezone()
+    end_of_day = start_of_day + timedelta(days=1)
+
+    events_result = (
+        service.events()
+        .list(
+            calendarId="primary",
+            timeMin=start_of_day.isoformat(),
+            timeMax=end_of_day.isoformat(),
+            singleEvents=True,
+            orderBy="startTime",
+        )
+        .execute()
+    )
+
+    events = events_result.get("items", [])
+    if not events:
+        return f"You have no events on {day:%A, %B} {day.day}. 💆‍♀️"
+    return _format_events(events)
+
+
+def _format_events(events: list) -> str:
     lines = []
     for event in events:
-        start = event["start"].get("dateTime", event["start"].get("date"))
+        event_start = event["start"]
+        start = event_start.get("dateTime") or event_start.get("date")
         title = event.get("summary", "Untitled event")
 
-        if "T" in start:
-            time_str = start.split("T")[1][:5]
-        else:
-            time_str = "All day"
+        _, has_time, clock = start.partition("T")
+        time_str = clock[:5] if has_time else "All day"
 
         lines.append(f"{time_str} — {title}")
-
     return "\n".join(lines)
 
 
@@ -111,6 +213,7 @@ def add_event(summary: str, start_time: str, end_time: str, description: str = "
     }
     
     created_event = service.events().insert(calendarId='primary', body=event).execute()
+    invalidate_calendar_cache()
     return created_event
 
 
@@ -126,6 +229,11 @@ def get_next_free_slots(count: int = 3, min_duration_minutes: int = 15) -> list:
     Returns:
         List of datetime objects (timezone-aware)
     """
+    cache_key = ("free_slots", count, min_duration_minutes)
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        return list(cached)
+
     service = get_calendar_service()
     
     # Start from current time, round up to next 15-min interval
@@ -137,65 +245,61 @@ def get_next_free_slots(count: int = 3, min_duration_minutes: int = 15) -> list:
     # Search window: next 7 days
     search_end = search_start + timedelta(days=7)
     
-    # Get all events in this window
-    events_result = service.events().list(
-        calendarId='primary',
-        timeMin=search_start.isoformat(),
-        timeMax=search_end.isoformat(),
-        singleEvents=True,
-        orderBy='startTime'
-    ).execute()
-    
-    events = events_result.get('items', [])
-    
-    # Build list of busy periods
-    busy_periods = []
-    for event in events:
-        start = event['start'].get('dateTime', event['start'].get('date'))
-        end = event['end'].get('dateTime', event['end'].get('date'))
-        
-        # Skip all-day events
-        if 'T' not in start:
-            continue
-        
-        start_dt = datetime.fromisoformat(start.replace('Z', '+00:00'))
-        end_dt = datetime.fromisoformat(end.replace('Z', '+00:00'))
-        busy_periods.append((start_dt, end_dt))
+    # freeBusy returns the merged busy intervals directly, so we don't have
+    # to page through every event in the window and rebuild them ourselves.
+    freebusy = service.freebusy().query(body={
+        "timeMin": search_start.isoformat(),
+        "timeMax": search_end.isoformat(),
+        "items": [{"id": "primary"}],
+    }).execute()
+
+    busy_periods = sorted(
+        (
+            datetime.fromisoformat(period['start'].replace('Z', '+00:00')),
+            datetime.fromisoformat(period['end'].replace('Z', '+00:00')),
+        )
+        for period in freebusy.get('calendars', {}).get('primary', {}).get('busy', [])
+    )
     
-    # Find free slots
+    # Sweep the gaps between busy periods in order, cutting each gap into
+    # back-to-back slots. A final empty period at search_end closes the window.
     free_slots = []
     current_time = search_start
+    slot_length = timedelta(minutes=min_duration_minutes)
     
-    # Only search during waking hours (8am - 10pm)
-    while len(free_slots) < count and current_time < search_end:
-        # Skip nighttime hours
-        local_hour = current_time.astimezone().hour
-        if local_hour < 8 or local_hour >= 22:
-            # Jump to next 8am
-            current_time = current_time.replace(hour=8, minute=0, second=0)
-            current_time += timedelta(days=1)
-            continue
-        
-        slot_end = current_time + timedelta(minutes=min_duration_minutes)
-        
-        # Check if this slot overlaps with any busy period
-        is_free = True
-        for busy_start, busy_end in busy_periods:
-            if current_time < busy_end and slot_end > busy_start:
-                # Overlaps with busy period
-                is_free = False
-                # Jump to end of this busy period
-                current_time = busy_end
+    for busy_start, busy_end in busy_periods + [(search_end, search_end)]:
+        while len(free_slots) < count:
+            current_time = _next_waking_time(current_time)
+            slot_end = current_time + slot_length
+            if slot_end > busy_start:
                 break
-        
-        if is_free:
             free_slots.append(current_time)
             current_time = slot_end
-        else:
-            # Round up to next 15-min interval after the busy period
-            minutes_to_add = 15 - (current_time.minute % 15)
-            if minutes_to_add == 15:
-                minutes_to_add = 0
-            current_time += timedelta(minutes=minutes_to_add)
+        
+        if len(free_slots) >= count:
+            break
+        if busy_end > current_time:
+            current_time = _round_up_to_quarter_hour(busy_end)
     
-    return free_slots
\ No newline at end of file
+    _cache_put(cache_key, list(free_slots))
+    return free_slots
+
+
+def _next_waking_time(moment: datetime) -> datetime:
+    """Return moment, or the next 8am local time if it falls outside 8am - 10pm."""
+    local = moment.astimezone()
+    if 8 <= local.hour < 22:
+        return moment
+    morning = local.replace(hour=8, minute=0, second=0, microsecond=0)
+    if local.hour >= 22:
+        morning += timedelta(days=1)
+    return morning.astimezone(timezone.utc)
+
+
+def _round_up_to_quarter_hour(moment: datetime) -> datetime:
+    minutes_to_add = -moment.minute % 15
+    if minutes_to_add == 0 and not (moment.second or moment.microsecond):
+        return moment
+    if minutes_to_add == 0:
+        minutes_to_add = 15
+    return moment.replace(second=0, microsecond=0) + timedelta(minutes=minutes_to_add)
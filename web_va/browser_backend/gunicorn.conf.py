@@ -0,0 +1,24 @@
+import os
+
+# Threads overlap the I/O-bound routes (OpenAI, gTTS, Google Calendar).
+# One worker only: the synced tabs, the freeBusy cache and the LLM and
+# semantic caches live in process memory, so a second worker would serve
+# stale tabs and offer slots another worker just booked.
+bind = f"0.0.0.0:{os.getenv('PORT', '5050')}"
+worker_class = "gthread"
+workers = 1
+threads = 8
+timeout = 120
+
+
+def post_worker_init(worker):
+    # Load the local speech model in the worker, not a pre-fork master,
+    # so the first /transcribe doesn't pay for it.
+    # A failed load must not stop the worker from booting; /transcribe
+    # then falls back to Google speech recognition.
+    try:
+        import broswer
+
+        broswer._get_whisper_model()
+    except Exception as err:
+        worker.log.warning("Whisper warm-up failed: %s", err)
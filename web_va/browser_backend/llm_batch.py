@@ -0,0 +1,214 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+
+# Finished batch states whose unanswered requests are queued again.
+# Expired and cancelled batches may still carry replies for some requests.
+_REQUEUE_STATUSES = frozenset({"expired", "cancelled"})
+
+
+class BatchQueue:
+    """
+    Collects chat completion requests in a JSONL file and submits them
+    through the OpenAI Batch API, which costs half as much as live calls
+    but can take up to 24 hours. Meant for offline work only (precomputed
+    study plans, morning schedule summaries), never for interactive chat.
+
+    Submitted batches are kept as inflight_<batch id>.jsonl and polled
+    until they finish; replies land in batch_results.json, where reply()
+    looks them up by custom_id.
+    """
+
+    def __init__(self, client, storage_dir: Path, flush_after_seconds: float = 300,
+                 poll_seconds: float = 600):
+        self.client = client
+        self.storage_dir = storage_dir
+        self.flush_after_seconds = flush_after_seconds
+        self.poll_seconds = poll_seconds
+        self.pending_path = storage_dir / "batch_pending.jsonl"
+        self.results_path = storage_dir / "batch_results.json"
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self._poll_timer: Optional[threading.Timer] = None
+
+        # A crash between moving the queue aside and recording the batch
+        # leaves a submitting file behind; its requests go back in the queue.
+        for path in storage_dir.glob("batch_submitting_*.jsonl"):
+            self._requeue(path)
+        # Requests queued shortly before a restart still get submitted.
+        with self._lock:
+            if self.pending_path.exists() and self.pending_path.stat().st_size:
+                self._start_flush_timer()
+        # Batches submitted before a restart are still collected.
+        if any(storage_dir.glob("inflight_*.jsonl")):
+            self._schedule_poll()
+
+    def enqueue(self, custom_id: str, **body) -> str:
+        """Queue one /v1/chat/completions request; returns its custom_id."""
+        line = json.dumps({
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": body,
+        }, ensure_ascii=False)
+
+        with self._lock:
+            self.storage_dir.mkdir(parents=True, exist_ok=True)
+            with open(self.pending_path, "a", encoding="utf-8") as fh:
+                fh.write(line + "\n")
+            self._start_flush_timer()
+        return custom_id
+
+    def flush(self) -> Optional[str]:
+        """Submit everything queued so far. Returns the batch id, or None if empty."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self.pending_path.exists() or self.pending_path.stat().st_size == 0:
+                return None
+            # Move the file aside first so new requests start a fresh batch.
+            submitting_path = self.storage_dir / f"batch_submitting_{int(time.time() * 1000)}.jsonl"
+            self.pending_path.replace(submitting_path)
+
+        try:
+            with open(submitting_path, "rb") as fh:
+                upload = self.client.files.create(file=fh, purpose="batch")
+            batch = self.client.batches.create(
+                input_file_id=upload.id,
+                endpoint="/v1/chat/completions",
+                completion_window="24h",
+            )
+        except Exception:
+            # Put the requests back so the next flush retries them.
+            self._requeue(submitting_path)
+            raise
+
+        submitting_path.replace(self.storage_dir / f"inflight_{batch.id}.jsonl")
+        self._schedule_poll()
+        return batch.id
+
+    def results(self, batch_id: str) -> Optional[Dict[str, str]]:
+        """
+        Return {custom_id: reply text} once the batch has completed,
+        or None while it is still running.
+        """
+        batch = self.client.batches.retrieve(batch_id)
+        if batch.status != "completed":
+            return None
+        return self._replies(batch)
+
+    def collect(self) -> int:
+        """
+        Check every in-flight batch once and store the replies of those
+        that finished. Returns how many replies were stored.
+        """
+        stored = 0
+        for path in sorted(self.storage_dir.glob("inflight_*.jsonl")):
+            batch_id = path.stem[len("inflight_"):]
+            batch = self.client.batches.retrieve(batch_id)
+            if batch.status == "completed" or batch.status in _REQUEUE_STATUSES:
+                replies = self._replies(batch)
+                self._store_replies(replies)
+                stored += len(replies)
+                if batch.status == "completed":
+                    path.unlink()
+                else:
+                    self._requeue(path, answered=replies)
+            elif batch.status == "failed":
+                # Usually a malformed input file; retrying would fail again.
+                print(f"OpenAI batch {batch_id} failed: {batch.errors}")
+                path.replace(self.storage_dir / f"failed_{batch_id}.jsonl")
+        return stored
+
+    def reply(self, custom_id: str) -> Optional[str]:
+        """The stored reply for custom_id, or None until its batch has been collected."""
+        with self._lock:
+            return self._load_results().get(custom_id)
+
+    def _replies(self, batch) -> Dict[str, str]:
+        replies = {}
+        if not batch.output_file_id:
+            return replies
+        output = self.client.files.content(batch.output_file_id).text
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get("response") or {}
+            if response.get("status_code") != 200:
+                continue
+            choices = (response.get("body") or {}).get("choices") or []
+            if choices:
+                replies[record["custom_id"]] = (choices[0]["message"].get("content") or "").strip()
+        return replies
+
+    def _load_results(self) -> Dict[str, str]:
+        try:
+            with open(self.results_path, encoding="utf-8") as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return {}
+
+    def _store_replies(self, replies: Dict[str, str]):
+        if not replies:
+            return
+        with self._lock:
+            results = self._load_results()
+            results.update(replies)
+            tmp_path = self.results_path.with_name(self.results_path.name + ".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as fh:
+                json.dump(results, fh, ensure_ascii=False)
+            os.replace(tmp_path, self.results_path)
+
+    def _requeue(self, path: Path, answered: Dict[str, str] = None):
+        """Move the requests in path back into the pending queue, minus any already answered."""
+        with self._lock:
+            with open(path, encoding="utf-8") as fh:
+                lines = [
+                    line for line in fh
+                    if line.strip() and json.loads(line)["custom_id"] not in (answered or {})
+                ]
+            if lines:
+                with open(self.pending_path, "a", encoding="utf-8") as fh:
+                    fh.writelines(line if line.endswith("\n") else line + "\n" for line in lines)
+                self._start_flush_timer()
+            path.unlink()
+
+    def _start_flush_timer(self):
+        # Caller holds self._lock.
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_after_seconds, self._flush_from_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _schedule_poll(self):
+        with self._lock:
+            if self._poll_timer is None:
+                self._poll_timer = threading.Timer(self.poll_seconds, self._poll_from_timer)
+                self._poll_timer.daemon = True
+                self._poll_timer.start()
+
+    def _flush_from_timer(self):
+        try:
+            batch_id = self.flush()
+            if batch_id:
+                print(f"Submitted OpenAI batch {batch_id}")
+        except Exception as err:
+            print(f"Batch flush error: {err}")
+
+    def _poll_from_timer(self):
+        with self._lock:
+            self._poll_timer = None
+        try:
+            stored = self.collect()
+            if stored:
+                print(f"Collected {stored} OpenAI batch replies")
+        except Exception as err:
+            print(f"Batch collect error: {err}")
+        if any(self.storage_dir.glob("inflight_*.jsonl")):
+            self._schedule_poll()
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+
+
+# Request fields that change what the model returns. Anything else
+# (timeouts, headers, stream callbacks) is left out of the cache key.
+KEY_FIELDS = (
+    "model",
+    "messages",
+    "temperature",
+    "functions",
+    "function_call",
+    "response_format",
+    "max_tokens",
+)
+
+
+class CompletionCache:
+    """
+    Two-level cache for chat completion payloads.
+
+    A small in-memory LRU sits in front of a SQLite table so hot prompts
+    never touch disk, while the table keeps answers across restarts.
+    Entries expire after their TTL and the least recently used rows are
+    evicted once the table grows past max_entries.
+    """
+
+    def __init__(self, storage_path: Path, max_entries: int = 2000, memory_entries: int = 128):
+        self.storage_path = storage_path
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.storage_path), check_same_thread=False)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            " key TEXT PRIMARY KEY,"
+            " payload TEXT NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS completions_last_used ON completions (last_used)"
+        )
+        conn.commit()
+        return conn
+
+    @staticmethod
+    def make_key(params: Dict) -> str:
+        keyed = {field: params.get(field) for field in KEY_FIELDS}
+        blob = json.dumps(keyed, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        now = time.time()
+        with self._lock:
+            hit = self._memory.get(key)
+            if hit is not None:
+                payload, expires_at = hit
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    return payload
+                del self._memory[key]
+
+            try:
+                row = self._conn.execute(
+                    "SELECT payload, expires_at FROM completions WHERE key = ?",
+                    (key,),
+                ).fetchone()
+                if row is None:
+                    return None
+                if row[1] <= now:
+                    self._conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+                    self._conn.commit()
+                    return None
+                self._conn.execute(
+                    "UPDATE completions SET last_used = ? WHERE key = ?", (now, key)
+                )
+                self._conn.commit()
+            except sqlite3.Error as err:
+                print(f"Completion cache read error: {err}")
+                return None
+
+            payload = json.loads(row[0])
+            self._remember(key, payload, row[1])
+            return payload
+
+    def put(self, key: str, payload: Dict, ttl_seconds: float):
+        now = time.time()
+        expires_at = now + ttl_seconds
+        with self._lock:
+            self._remember(key, payload, expires_at)
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO completions (key, payload, expires_at, last_used)"
+                    " VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(payload, ensure_ascii=False), expires_at, now),
+                )
+                self._evict(now)
+                self._conn.commit()
+            except sqlite3.Error as err:
+                print(f"Completion cache write error: {err}")
+
+    def _remember(self, key: str, payload: Dict, expires_at: float):
+        self._memory[key] = (payload, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self, now: float):
+        self._conn.execute("DELETE FROM completions WHERE expires_at <= ?", (now,))
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM completions").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM completions WHERE key IN ("
+                " SELECT key FROM completions ORDER BY last_used ASC LIMIT ?)",
+                (overflow,),
+            )
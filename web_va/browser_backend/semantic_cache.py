@@ -0,0 +1,134 @@
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+
+# Apostrophes are dropped and letters/digits split apart so "can't" matches
+# "cant" and "3pm" matches "3 pm" before any similarity is computed.
+_WORD_RE = re.compile(r"[a-z]+|[0-9]+")
+
+# Similarity needed for a MiniLM hit. Without an embedding model only
+# messages that normalize to the same text match: surface similarity can't
+# tell "I can do this" from "I cant do this" or "sad" from "mad".
+MINILM_THRESHOLD = 0.95
+EXACT_THRESHOLD = 1.0
+
+_MINILM_MODEL_NAME = "all-MiniLM-L6-v2"
+_minilm_model = None
+_minilm_lock = threading.Lock()
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(_WORD_RE.findall((text or "").lower().replace("'", "")))
+
+
+def exact_embedding(text: str) -> Dict[str, float]:
+    """One-hot on the normalized text, so similarity is 1.0 only for equal text."""
+    normalized = normalize_text(text)
+    return {normalized: 1.0} if normalized else {}
+
+
+def minilm_embedding(text: str) -> Dict[int, float]:
+    """MiniLM sentence embedding, loaded on first use."""
+    global _minilm_model
+    with _minilm_lock:
+        if _minilm_model is None:
+            _minilm_model = SentenceTransformer(_MINILM_MODEL_NAME)
+    vector = _minilm_model.encode(normalize_text(text), normalize_embeddings=True)
+    return {i: float(v) for i, v in enumerate(vector)}
+
+
+def _dot(vec_a: Dict, vec_b: Dict) -> float:
+    if len(vec_a) > len(vec_b):
+        vec_a, vec_b = vec_b, vec_a
+    return sum(v * vec_b.get(k, 0.0) for k, v in vec_a.items())
+
+
+class SemanticCache:
+    """
+    Reuse responses for near-duplicate messages.
+
+    Each entry keeps the embedding of the message it answered. A lookup
+    embeds the new message and returns the stored response of the most
+    similar live entry when the cosine similarity reaches the threshold.
+    Uses MiniLM when sentence-transformers is installed and its model
+    loads; otherwise only messages that are equal after normalization hit.
+    """
+
+    def __init__(self, threshold: float = None, max_entries: int = 256, ttl_seconds: float = 600):
+        if SentenceTransformer is not None:
+            self._embed = minilm_embedding
+            default_threshold = MINILM_THRESHOLD
+        else:
+            self._embed = exact_embedding
+            default_threshold = EXACT_THRESHOLD
+        self._fixed_threshold = threshold is not None
+        self.threshold = default_threshold if threshold is None else threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def _embedding(self, message: str) -> Dict:
+        try:
+            return self._embed(message)
+        except Exception as err:
+            if self._embed is exact_embedding:
+                raise
+            # Usually the MiniLM download failed. Don't retry it on every
+            # message; MiniLM entries can't match one-hot ones, so drop them.
+            print(f"Semantic cache embedding error, matching exact text only: {err}")
+            with self._lock:
+                self._embed = exact_embedding
+                if not self._fixed_threshold:
+                    self.threshold = EXACT_THRESHOLD
+                self._entries = []
+            return exact_embedding(message)
+
+    def lookup(self, message: str) -> Optional[str]:
+        query = self._embedding(message)
+        if not query:
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            self._entries = [e for e in self._entries if e["expires_at"] > now]
+            best_score = 0.0
+            best_entry = None
+            for entry in self._entries:
+                score = _dot(query, entry["embedding"])
+                if score > best_score:
+                    best_score, best_entry = score, entry
+
+            if best_entry is None or best_score < self.threshold:
+                return None
+            best_entry["last_used"] = now
+            return best_entry["response"]
+
+    def store(self, message: str, response: str):
+        embedding = self._embedding(message)
+        if not embedding or not response:
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            self._entries.append({
+                "embedding": embedding,
+                "message": message,
+                "response": response,
+                "expires_at": now + self.ttl_seconds,
+                "last_used": now,
+            })
+            if len(self._entries) > self.max_entries:
+                self._entries.sort(key=lambda e: e["last_used"], reverse=True)
+                del self._entries[self.max_entries:]
+
+    def clear(self):
+        with self._lock:
+            self._entries = []
@@ -1,85 +1,524 @@
+import hashlib
+import heapq
 import json
 import math
 import os
-import re
-from collections import Counter
+import sys
+import threading
+from collections import Counter, OrderedDict
 from pathlib import Path
 from typing import List, Dict
 
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = None
+    sparse = None
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _json_loads(raw: bytes):
+    if orjson is not None:
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            # json.dumps below writes lone surrogates as escapes orjson refuses.
+            pass
+    return json.loads(raw)
+
+
+def _json_dumps(value) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(value)
+        except TypeError:
+            # e.g. a lone surrogate scraped from a page; json escapes those.
+            pass
+    return json.dumps(value).encode("utf-8")
+
+
+try:
+    # Compiled from _cosine_csr.pyx when it has been built in place.
+    from _cosine_csr import csr_dot_dense as _csr_dot_dense
+except ImportError:
+    _csr_dot_dense = None
+
+
+if _csr_dot_dense is None and numba is not None and np is not None:
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _csr_dot_dense(data, indices, indptr, query, out):
+        """out[row] = CSR row · dense query, one row per thread, without the GIL."""
+        for row in numba.prange(len(indptr) - 1):
+            total = 0.0
+            for j in range(indptr[row], indptr[row + 1]):
+                total += data[j] * query[indices[j]]
+            out[row] = total
+
+    # Compile now (or load the on-disk cache) instead of on the first search.
+    _csr_dot_dense(
+        np.ones(1), np.zeros(1, dtype=np.int32), np.array([0, 1], dtype=np.int32),
+        np.ones(1), np.empty(1),
+    )
+
+
+# Tokens are runs of three or more [a-z0-9] in the lowercased text. Text is
+# encoded to ASCII with every other character replaced by "?", then this
+# table turns everything outside [a-z0-9] into a space, so a plain split()
+# gives the same tokens a regex would without the per-match objects.
+_TOKEN_TABLE = bytes(
+    c if (ord("a") <= c <= ord("z") or ord("0") <= c <= ord("9")) else ord(" ")
+    for c in range(256)
+)
+
+# Repeated queries (group_tabs_for_subtasks runs one per subtask, and the
+# same task comes back across turns) are answered from a small LRU.
+SEARCH_CACHE_ENTRIES = 256
+
+# Vocabulary cap applied at sync time; see _TabIndex._prune_vocabulary.
+MAX_VOCABULARY = 20000
+
+# Bump whenever tokenizing or weighting changes. Together with the token
+# table and the vocabulary cap it is hashed into the sidecar key, so a
+# .vec.npz written by older code is rebuilt instead of loaded.
+VECTORIZER_VERSION = 3
+_VECTORIZER_PARAMS = hashlib.sha256(
+    f"{VECTORIZER_VERSION}:{MAX_VOCABULARY}:".encode("ascii")
+    + _TOKEN_TABLE
+).digest()
+
+
+def _snapshot_checksum(raw: bytes) -> str:
+    """Sidecar key for a tab_cache.json payload under the current vectorizer."""
+    return hashlib.sha256(_VECTORIZER_PARAMS + raw).hexdigest()
+
+
+def _tokenize_text(text: str) -> List[str]:
+    # Interned so equal tokens across tabs and queries share one object
+    # and dict probes short-circuit on identity.
+    words = (text or "").lower().encode("ascii", "replace").translate(_TOKEN_TABLE).split()
+    return [sys.intern(word.decode("ascii")) for word in words if len(word) >= 3]
+
+
+def _count_tab_tokens(tab: Dict) -> Counter:
+    return Counter(_tokenize_text(f"{tab.get('title', '')} {tab.get('content', '')}"))
+
+
+class _TabIndex:
+    """
+    One vectorized tab snapshot. A sync builds a whole new index and
+    publishes it with a single assignment, so a concurrent search always
+    scores one consistent snapshot and never sees new tabs with an old
+    vocabulary.
+    """
+
+    def __init__(self, tabs: List[Dict], version: int):
+        self.tabs = tabs
+        # Cache keys carry it so answers from an older snapshot never match.
+        self.version = version
+        self.idf: Dict[str, float] = {}
+        self.vectors: List[Dict[str, float]] = []
+        self._postings: Dict[str, List[int]] = {}
+        self._tab_arrays: tuple = ()
+        self._vocab: Dict[str, int] = {}
+        self._matrix = None
+        # First tab wins when the same URL is open twice, matching search order.
+        self.tabs_by_url: Dict[str, Dict] = {}
+        for tab in tabs:
+            self.tabs_by_url.setdefault(tab.get("url") or "", tab)
+
+    @classmethod
+    def from_matrix(cls, tabs: List[Dict], version: int, vocab: List[str], idf: List[float], matrix) -> "_TabIndex":
+        index = cls(tabs, version)
+        index.idf = dict(zip(vocab, idf))
+        index._vocab = {token: col for col, token in enumerate(vocab)}
+        index._matrix = matrix
+        return index
+
+    def build(self, counts: List[Counter]):
+        doc_freq = Counter(token for tab_counts in counts for token in tab_counts)
+        n_tabs = len(counts)
+        self.idf = {
+            token: math.log((1 + n_tabs) / (1 + df)) + 1
+            for token, df in self._prune_vocabulary(doc_freq)
+        }
+
+        if sparse is not None:
+            self._build_matrix(counts)
+        elif np is not None:
+            # numpy without scipy: the corpus is three flat parallel arrays
+            # (tab index, vocabulary id, weight), i.e. a COO matrix.
+            self._vocab = {token: col for col, token in enumerate(self.idf)}
+            self._tab_arrays = self._build_arrays(counts)
+        else:
+            self.vectors = [self.weigh(tab_counts) for tab_counts in counts]
+            # token -> indices of the tabs containing it, in tab order.
+            for index, doc_vec in enumerate(self.vectors):
+                for token in doc_vec:
+                    self._postings.setdefault(token, []).append(index)
+
+    def weigh(self, counts: Counter) -> Dict[str, float]:
+        """Turn raw counts into an l2-normalized TF-IDF vector; unknown tokens are dropped."""
+        weights = {
+            token: count * self.idf[token]
+            for token, count in counts.items()
+            if token in self.idf
+        }
+        norm = math.sqrt(sum(w * w for w in weights.values()))
+        if not norm:
+            return {}
+        return {token: w / norm for token, w in weights.items()}
+
+    @staticmethod
+    def _prune_vocabulary(doc_freq: Counter) -> List[tuple]:
+        """
+        (token, df) pairs worth indexing: the rarest tokens go first if the
+        vocabulary outgrows MAX_VOCABULARY. Common tokens are kept even when
+        they are in nearly every tab, since that is often the topic being
+        searched for; smoothed idf already gives them the lowest weight.
+        """
+        kept = list(doc_freq.items())
+        if len(kept) > MAX_VOCABULARY:
+            kept.sort(key=lambda item: -item[1])
+            del kept[MAX_VOCABULARY:]
+        return kept
+
+    def _build_matrix(self, counts: List[Counter]):
+        self._vocab = {token: col for col, token in enumerate(self.idf)}
+        rows, cols, values = [], [], []
+        for row, tab_counts in enumerate(counts):
+            for token, count in tab_counts.items():
+                col = self._vocab.get(token)
+                if col is None:
+                    continue
+                rows.append(row)
+                cols.append(col)
+                values.append(count)
+
+        matrix = sparse.csr_matrix(
+            (np.asarray(values, dtype=np.float64), (rows, cols)),
+            shape=(len(counts), len(self._vocab)),
+        )
+        idf = np.fromiter(self.idf.values(), dtype=np.float64, count=len(self.idf))
+        matrix = sparse.csr_matrix(matrix.multiply(idf))
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        self._matrix = sparse.csr_matrix(sparse.diags(1.0 / norms) @ matrix)
+
+    def _to_arrays(self, weights: Dict[str, float]) -> tuple:
+        cols = np.fromiter((self._vocab[token] for token in weights), dtype=np.int32, count=len(weights))
+        values = np.fromiter(weights.values(), dtype=np.float64, count=len(weights))
+        order = np.argsort(cols)
+        return cols[order], values[order]
+
+    def _build_arrays(self, counts: List[Counter]) -> tuple:
+        per_tab = [self._to_arrays(self.weigh(tab_counts)) for tab_counts in counts]
+        rows = np.repeat(
+            np.arange(len(per_tab), dtype=np.int32),
+            [len(cols) for cols, _ in per_tab],
+        )
+        cols = np.concatenate([cols for cols, _ in per_tab] or [np.empty(0, dtype=np.int32)])
+        values = np.concatenate([values for _, values in per_tab] or [np.empty(0)])
+        return rows, cols, values
+
+    def _cosine_similarity(self, vec_a: Dict[str, float], vec_b: Dict[str, float]) -> float:
+        # Both vectors are already l2-normalized, so cosine is the dot product.
+        if not vec_a or not vec_b:
+            return 0.0
+        # Probe the larger vector from the smaller one; misses cost one lookup.
+        if len(vec_a) > len(vec_b):
+            vec_a, vec_b = vec_b, vec_a
+        dot = 0.0
+        for token, weight in vec_a.items():
+            other = vec_b.get(token)
+            if other is not None:
+                dot += weight * other
+        return dot
+
+    def _result(self, index: int, score: float) -> Dict:
+        tab = self.tabs[index]
+        return {
+            "title": tab.get("title") or "",
+            "url": tab.get("url") or "",
+            "snippet": (tab.get("content") or "")[:320],
+            "score": round(score, 4)
+        }
+
+    def _search_matrix(self, query_vec: Dict[str, float], top_k: int, min_score: float) -> List[Dict]:
+        if self._matrix is None:
+            return []
+        cols = [self._vocab[token] for token in query_vec]
+        if _csr_dot_dense is not None:
+            query_dense = np.zeros(len(self._vocab))
+            query_dense[cols] = list(query_vec.values())
+            scores = np.empty(self._matrix.shape[0])
+            _csr_dot_dense(
+                self._matrix.data, self._matrix.indices, self._matrix.indptr,
+                query_dense, scores,
+            )
+        else:
+            query_row = sparse.csr_matrix(
+                (list(query_vec.values()), ([0] * len(cols), cols)),
+                shape=(1, len(self._vocab)),
+            )
+            scores = (self._matrix @ query_row.T).toarray().ravel()
+        return self._top_results_from_scores(scores, top_k, min_score)
+
+    def _top_results_from_scores(self, scores, top_k: int, min_score: float) -> List[Dict]:
+        candidates = np.flatnonzero(scores >= min_score)
+        # Rank on the rounded score, ties in tab order, like the pure-Python path.
+        ranked = np.round(scores[candidates], 4)
+        if len(candidates) > top_k:
+            # Partial selection of the k-th best score; everything tied with
+            # it stays in so the tab-order tie-break below is exact.
+            cutoff = -np.partition(-ranked, top_k - 1)[top_k - 1]
+            keep = ranked >= cutoff
+            candidates, ranked = candidates[keep], ranked[keep]
+        order = np.lexsort((candidates, -ranked))[:top_k]
+        return [self._result(int(i), float(scores[i])) for i in candidates[order]]
+
+    def _search_arrays(self, query_vec: Dict[str, float], top_k: int, min_score: float) -> List[Dict]:
+        rows, cols, values = self._tab_arrays
+        query_dense = np.zeros(len(self._vocab))
+        query_dense[[self._vocab[token] for token in query_vec]] = list(query_vec.values())
+        # One sparse mat-vec for every tab at once: weight each stored entry
+        # by the query and sum per tab.
+        scores = np.bincount(rows, weights=values * query_dense[cols], minlength=len(self.tabs))
+        return self._top_results_from_scores(scores, top_k, min_score)
+
+    def _top_results(self, scored: List[tuple], top_k: int) -> List[Dict]:
+        # nlargest keeps tab order on ties, like a stable sort, and only the
+        # survivors get a result dict.
+        best = heapq.nlargest(top_k, scored, key=lambda item: round(item[1], 4))
+        return [self._result(index, score) for index, score in best]
+
+    def search(self, query_vec: Dict[str, float], top_k: int, min_score: float) -> List[Dict]:
+        # Tokens outside the vocabulary are weighed away, so an empty vector
+        # means nothing can score above zero; skip the pass over every tab.
+        if not query_vec:
+            return []
+        if sparse is not None:
+            return self._search_matrix(query_vec, top_k, min_score)
+        if np is not None:
+            return self._search_arrays(query_vec, top_k, min_score)
+
+        # Only tabs sharing a token with the query can score above zero.
+        candidates = set()
+        for token in query_vec:
+            candidates.update(self._postings.get(token, ()))
+
+        scored = []
+        for index in sorted(candidates):
+            score = self._cosine_similarity(query_vec, self.vectors[index])
+            if score >= min_score:
+                scored.append((index, score))
+        return self._top_results(scored, top_k)
+
 
 class TabRetriever:
+    """
+    TF-IDF search over the synced tab snapshot.
+
+    Tabs are scored by cosine similarity between l2-normalized TF-IDF
+    vectors (smoothed idf, as in scikit-learn). With numpy and scipy
+    installed the corpus is a CSR matrix and a query is one sparse
+    mat-vec; otherwise the same weights live in per-tab dicts.
+    """
+
     def __init__(self, storage_path: Path):
         self.storage_path = storage_path
-        self.tabs: List[Dict] = []
-        self.vectors: List[Counter] = []
+        self._index = _TabIndex([], 0)
+        # (title, content) -> token Counter from the last sync.
+        self._token_counts: Dict[tuple, Counter] = {}
+        self._query_cache: "OrderedDict[tuple, Dict[str, float]]" = OrderedDict()
+        self._search_cache: "OrderedDict[tuple, List[Dict]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # Serializes syncs. Searches read self._index once and take no lock.
+        self._sync_lock = threading.Lock()
+        # Vectorized snapshot, reused on boot while tab_cache.json is unchanged.
+        self._sidecar_path = storage_path.with_suffix(".vec.npz")
         self._load()
 
+    @property
+    def tabs(self) -> List[Dict]:
+        return self._index.tabs
+
+    @property
+    def tabs_by_url(self) -> Dict[str, Dict]:
+        return self._index.tabs_by_url
+
     def _load(self):
+        raw = b""
+        tabs = []
         if self.storage_path.exists():
             try:
-                with open(self.storage_path, "r", encoding="utf-8") as fh:
-                    self.tabs = json.load(fh)
+                raw = self.storage_path.read_bytes()
+                tabs = _json_loads(raw)
             except Exception:
-                self.tabs = []
-        else:
-            self.tabs = []
-        self._vectorize_all()
+                tabs = []
+                raw = b""
+
+        checksum = _snapshot_checksum(raw)
+        index = self._load_sidecar(tabs, checksum) if raw else None
+        if index is None:
+            index = self._build_index(tabs, 0)
+            if raw:
+                self._save_sidecar(index, checksum)
+        self._index = index
+
+    def _load_sidecar(self, tabs: List[Dict], checksum: str):
+        if sparse is None or not self._sidecar_path.exists():
+            return None
+        try:
+            with np.load(self._sidecar_path) as saved:
+                if str(saved["checksum"]) != checksum:
+                    return None
+                vocab = saved["vocab"].tolist()
+                idf = saved["idf"].tolist()
+                matrix = sparse.csr_matrix(
+                    (saved["data"], saved["indices"], saved["indptr"]),
+                    shape=tuple(saved["shape"]),
+                )
+        except Exception as err:
+            # Truncated or foreign files raise BadZipFile, EOFError and the
+            # like; any of them just means rebuilding from tab_cache.json.
+            print(f"Tab vector cache read error: {err}")
+            return None
+        return _TabIndex.from_matrix(tabs, 0, vocab, idf, matrix)
+
+    def _save_sidecar(self, index: _TabIndex, checksum: str):
+        if index._matrix is None:
+            return
+        tmp_path = self._sidecar_path.with_name(self._sidecar_path.name + ".tmp")
+        try:
+            with open(tmp_path, "wb") as fh:
+                np.savez(
+                    fh,
+                    checksum=np.array(checksum),
+                    vocab=np.array(list(index._vocab), dtype=str),
+                    idf=np.fromiter(index.idf.values(), dtype=np.float64, count=len(index.idf)),
+                    data=index._matrix.data,
+                    indices=index._matrix.indices,
+                    indptr=index._matrix.indptr,
+                    shape=np.array(index._matrix.shape),
+                )
+            os.replace(tmp_path, self._sidecar_path)
+        except OSError as err:
+            print(f"Tab vector cache write error: {err}")
+
+    def _count_all_tabs(self, tabs: List[Dict]) -> List[Counter]:
+        """
+        Token counts for every tab, reusing the previous sync's counts for
+        tabs whose title and content are unchanged. Snapshots usually differ
+        by a few opened or closed tabs, so only those get tokenized.
+        """
+        keys = [(tab.get("title", ""), tab.get("content", "")) for tab in tabs]
+        missing = {}
+        for key, tab in zip(keys, tabs):
+            if key not in self._token_counts and key not in missing:
+                missing[key] = tab
+
+        counts_by_key = {key: self._token_counts[key] for key in keys if key in self._token_counts}
+        counts_by_key.update((key, self._vectorize_tab(tab)) for key, tab in missing.items())
+        # Keyed on the new snapshot only, so closed tabs are forgotten.
+        self._token_counts = counts_by_key
+        return [counts_by_key[key] for key in keys]
 
-    def _vectorize_all(self):
-        self.vectors = [self._vectorize_tab(tab) for tab in self.tabs]
+    def _build_index(self, tabs: List[Dict], version: int) -> _TabIndex:
+        index = _TabIndex(tabs, version)
+        index.build(self._count_all_tabs(tabs))
+        return index
 
     def has_tabs(self) -> bool:
-        return len(self.tabs) > 0
+        return len(self._index.tabs) > 0
 
     def save_tabs(self, tabs: List[Dict]):
         sanitized = []
+        append = sanitized.append
         for tab in tabs or []:
-            sanitized.append({
-                "title": (tab.get("title") or "")[:200],
-                "url": tab.get("url") or "",
-                "content": (tab.get("content") or "")[:6000]
+            get = tab.get
+            title = get("title") or ""
+            content = get("content") or ""
+            # Most fields are already short, so the slice is usually skipped.
+            if len(title) > 200:
+                title = title[:200]
+            if len(content) > 6000:
+                content = content[:6000]
+            append({
+                "id": get("id"),
+                "title": title,
+                "url": get("url") or "",
+                "content": content
             })
-        with open(self.storage_path, "w", encoding="utf-8") as fh:
-            json.dump(sanitized, fh)
-        self.tabs = sanitized
-        self._vectorize_all()
+        payload = _json_dumps(sanitized)
+        with self._sync_lock:
+            with open(self.storage_path, "wb") as fh:
+                fh.write(payload)
+            index = self._build_index(sanitized, self._index.version + 1)
+            self._save_sidecar(index, _snapshot_checksum(payload))
+            with self._cache_lock:
+                self._index = index
+                self._query_cache.clear()
+                self._search_cache.clear()
+
+    def _cache_get(self, cache: OrderedDict, key: tuple):
+        with self._cache_lock:
+            value = cache.get(key)
+            if value is not None:
+                cache.move_to_end(key)
+            return value
+
+    def _cache_put(self, cache: OrderedDict, key: tuple, value):
+        with self._cache_lock:
+            if key[0] != self._index.version:
+                return
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > SEARCH_CACHE_ENTRIES:
+                cache.popitem(last=False)
 
     def _tokenize(self, text: str) -> List[str]:
-        return re.findall(r"[a-z0-9]{3,}", (text or "").lower())
+        return _tokenize_text(text)
 
     def _vectorize_tab(self, tab: Dict) -> Counter:
-        text = f"{tab.get('title', '')} {tab.get('content', '')}"
-        return Counter(self._tokenize(text))
+        return _count_tab_tokens(tab)
 
-    def _vectorize_query(self, query: str) -> Counter:
-        return Counter(self._tokenize(query))
-
-    def _cosine_similarity(self, vec_a: Counter, vec_b: Counter) -> float:
-        if not vec_a or not vec_b:
-            return 0.0
-        dot = sum(vec_a[token] * vec_b.get(token, 0) for token in vec_a)
-        norm_a = math.sqrt(sum(v * v for v in vec_a.values()))
-        norm_b = math.sqrt(sum(v * v for v in vec_b.values()))
-        if not norm_a or not norm_b:
-            return 0.0
-        return dot / (norm_a * norm_b)
+    def _vectorize_query(self, index: _TabIndex, query: str) -> Dict[str, float]:
+        key = (index.version, query)
+        query_vec = self._cache_get(self._query_cache, key)
+        if query_vec is None:
+            query_vec = index.weigh(Counter(self._tokenize(query)))
+            self._cache_put(self._query_cache, key, query_vec)
+        return query_vec
 
     def search(self, query: str, top_k: int = 3, min_score: float = 0.05) -> List[Dict]:
-        query_vec = self._vectorize_query(query)
-        results = []
-        for index, doc_vec in enumerate(self.vectors):
-            score = self._cosine_similarity(query_vec, doc_vec)
-            if score >= min_score:
-                tab = self.tabs[index]
-                snippet = (tab.get("content") or "")[:320]
-                results.append({
-                    "title": tab.get("title") or "",
-                    "url": tab.get("url") or "",
-                    "snippet": snippet,
-                    "score": round(score, 4)
-                })
-        results.sort(key=lambda item: item["score"], reverse=True)
-        return results[:top_k]
+        index = self._index
+        key = (index.version, query, top_k, min_score)
+        results = self._cache_get(self._search_cache, key)
+        if results is None:
+            results = index.search(self._vectorize_query(index, query), top_k, min_score)
+            self._cache_put(self._search_cache, key, results)
+        # Callers annotate the dicts (e.g. with tab ids), so hand out copies.
+        return [dict(result) for result in results]
+
+    def search_vec(self, counts: Counter, top_k: int = 3, min_score: float = 0.05) -> List[Dict]:
+        """Like search, for a query that is already tokenized into counts."""
+        index = self._index
+        key = (index.version, frozenset(counts.items()), top_k, min_score)
+        results = self._cache_get(self._search_cache, key)
+        if results is None:
+            results = index.search(index.weigh(counts), top_k, min_score)
+            self._cache_put(self._search_cache, key, results)
+        return [dict(result) for result in results]
 
 
 _storage_path = Path(__file__).resolve().parent / "tab_cache.json"
@@ -99,9 +538,11 @@ def group_tabs_for_subtasks(task_name: str, subtask_names: List[str], top_k: int
     if not retriever_has_tabs():
         return groups
 
+    # Every query shares the task name, so it is tokenized once.
+    task_counts = Counter(_retriever._tokenize(task_name))
     for name in subtask_names:
-        combined_query = f"{task_name} {name}".strip()
-        tabs = _retriever.search(combined_query, top_k=top_k)
+        query_counts = task_counts + Counter(_retriever._tokenize(name))
+        tabs = _retriever.search_vec(query_counts, top_k=top_k)
         groups.append({
             "subtask": name,
             "tabs": tabs,
@@ -0,0 +1,92 @@
+import hashlib
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Optional
+
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
+
+
+class SpeechCache:
+    """
+    Disk cache for synthesized speech, keyed by SHA-256 of language + text.
+
+    Uses a size-limited diskcache.Cache when diskcache is installed.
+    Otherwise each clip is a plain .mp3 file in storage_dir, written to a
+    temp file and renamed into place so a concurrent reader never sees a
+    partial clip; the least recently read files are removed once the
+    directory grows past size_limit bytes.
+    """
+
+    def __init__(self, storage_dir: Path, size_limit: int = 512 << 20):
+        self.storage_dir = storage_dir
+        self.size_limit = size_limit
+        self._lock = threading.Lock()
+        self._cache = (
+            diskcache.Cache(str(storage_dir), size_limit=size_limit)
+            if diskcache is not None else None
+        )
+
+    @staticmethod
+    def make_key(text: str, lang: str) -> str:
+        # Collapse whitespace only; case is kept because gTTS reads
+        # acronyms ("US", "AI") differently from the lowercase words.
+        normalized = " ".join((text or "").split())
+        return hashlib.sha256(f"{lang}:{normalized}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        if self._cache is not None:
+            return self._cache.get(key)
+
+        path = self.storage_dir / f"{key}.mp3"
+        try:
+            blob = path.read_bytes()
+            os.utime(path)
+        except OSError:
+            return None
+        return blob or None
+
+    def put(self, key: str, blob: bytes):
+        if not blob:
+            return
+        if self._cache is not None:
+            self._cache.set(key, blob)
+            return
+
+        try:
+            self.storage_dir.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.storage_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(blob)
+            os.replace(tmp_path, self.storage_dir / f"{key}.mp3")
+            with self._lock:
+                self._evict()
+        except OSError as err:
+            print(f"Speech cache write error: {err}")
+
+    def _evict(self):
+        clips = []
+        total = 0
+        for path in self.storage_dir.glob("*.mp3"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            clips.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        if total <= self.size_limit:
+            return
+        clips.sort()
+        for _, size, path in clips:
+            if total <= self.size_limit:
+                break
+            try:
+                path.unlink()
+                total -= size
+            except OSError:
+                pass